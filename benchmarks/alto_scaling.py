@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark of ALTO text extraction: builds a synthetic ALTO page, then
+   extracts the text and scaled coordinates of every text block the way the
+   annotations for a page are built. Compares a reference implementation of
+   per-element Region classes on a parsed tree with the streaming, vectorized
+   ocr.iter_textblocks, and ID lookups of text blocks by XPath with an index.
+
+   optional arguments:
+   -h, --help               show this help message and exit
+   -b BLOCKS, --blocks BLOCKS
+                            Number of text blocks on the page (default 500).
+   -n REPEAT, --repeat REPEAT
+                            Number of times to time each method (default 5)."""
+
+import argparse
+import io
+import os
+import random
+import sys
+import timeit
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from plastron import ocr  # noqa: E402
+
+LINES_PER_BLOCK = 10
+STRINGS_PER_LINE = 8
+IMAGE_RESOLUTION = (400, 400)
+
+
+def synthetic_alto(blocks):
+    r = random.Random(0)
+    out = io.StringIO()
+    out.write(
+        f'<alto xmlns="{ocr.ns["alto"]}"><Description><MeasurementUnit>inch1200</MeasurementUnit></Description>'
+        '<Layout><Page ID="P1"><PrintSpace>'
+    )
+    for b in range(blocks):
+        out.write(f'<TextBlock ID="TB{b}" HPOS="{r.randrange(9000)}" VPOS="{r.randrange(9000)}" '
+                  f'WIDTH="{r.randrange(1, 900)}" HEIGHT="{r.randrange(1, 900)}">')
+        for n in range(LINES_PER_BLOCK):
+            out.write(f'<TextLine HPOS="{r.randrange(9000)}" VPOS="{r.randrange(9000)}" WIDTH="900" HEIGHT="40">')
+            for s in range(STRINGS_PER_LINE):
+                out.write(f'<String CONTENT="word{s}" HPOS="{r.randrange(9000)}" VPOS="{r.randrange(9000)}" '
+                          f'WIDTH="{r.randrange(1, 400)}" HEIGHT="{r.randrange(1, 90)}"/>')
+                out.write('<SP/>' if s < STRINGS_PER_LINE - 1 else '<HYP CONTENT="-"/>')
+            out.write('</TextLine>')
+        out.write('</TextBlock>')
+    out.write('</PrintSpace></Page></Layout></alto>')
+    return out.getvalue().encode()
+
+
+# Reference implementation: the per-element classes that built the text of a page's annotations
+# from a fully parsed ALTO tree before ocr.iter_textblocks, kept here to check and time it against.
+
+
+class ALTOResource(object):
+    def __init__(self, xmldoc, image_resolution):
+        self.xmldoc = xmldoc
+        unit = xmldoc.xpath('/alto:alto/alto:Description/alto:MeasurementUnit', namespaces=ocr.ns)[0].text
+        self.scale = ocr.get_scale(unit, image_resolution)
+        # TextBlock elements by ID, built on the first lookup
+        self.textblock_index = None
+
+    def textblocks(self):
+        for node in self.xmldoc.xpath("//alto:TextBlock", namespaces=ocr.ns):
+            yield TextBlock(node)
+
+    def textblock(self, id):
+        if self.textblock_index is None:
+            self.textblock_index = {}
+            for node in self.xmldoc.iter(ocr.ALTO_TEXT_BLOCK):
+                self.textblock_index.setdefault(node.get('ID'), node)
+        try:
+            return TextBlock(self.textblock_index[id])
+        except KeyError:
+            # as the XPath lookup did
+            raise IndexError(f'No TextBlock with ID "{id}"')
+
+
+class Region(object):
+    def __init__(self, element):
+        self.element = element
+        self.id = self.element.get('ID')
+        self.hpos = int(self.element.get('HPOS'))
+        self.vpos = int(self.element.get('VPOS'))
+        self.width = int(self.element.get('WIDTH'))
+        self.height = int(self.element.get('HEIGHT'))
+
+    def xywh(self, scale):
+        xscale = scale[0]
+        yscale = scale[1]
+        x = round(self.hpos * xscale)
+        y = round(self.vpos * yscale)
+        w = round(self.width * xscale)
+        h = round(self.height * yscale)
+
+        return x, y, w, h
+
+    def bbox(self, scale):
+        (x, y, w, h) = self.xywh(scale)
+        return x, y, x + w, y + h
+
+
+class TextBlock(Region):
+    def lines(self):
+        for node in self.element.xpath('alto:TextLine', namespaces=ocr.ns):
+            yield TextLine(node)
+
+    def text(self, scale=None):
+        return "\n".join([line.text(scale) for line in self.lines()])
+
+
+class TextLine(Region):
+    def inlines(self):
+        for node in self.element.xpath('alto:String|alto:SP|alto:HYP', namespaces=ocr.ns):
+            tag = etree.QName(node.tag)
+            if tag.localname == 'String':
+                yield String(node)
+            elif tag.localname == 'SP':
+                yield Space(node)
+            elif tag.localname == 'HYP':
+                yield Hyphen(node)
+
+    def text(self, scale=None):
+        return ''.join([inline.text(scale) for inline in self.inlines()])
+
+
+class String(Region):
+    def text(self, scale=None):
+        text = self.element.get('CONTENT')
+        if scale is None:
+            return text
+        xywh = ','.join([str(i) for i in self.xywh(scale)])
+        return '{0}|{1}'.format(text, xywh)
+
+
+class Space(object):
+    def __init__(self, element):
+        self.element = element
+        super(Space, self).__init__()
+
+    def text(self, scale=None):
+        return ocr.SPACE_TEXT
+
+
+class Hyphen(object):
+    def __init__(self, element):
+        self.element = element
+        super(Hyphen, self).__init__()
+
+    def text(self, scale=None):
+        return ocr.HYPHEN_TEXT
+
+
+def per_element(data):
+    alto = ALTOResource(etree.parse(io.BytesIO(data)), IMAGE_RESOLUTION)
+    return [(block.id, block.xywh(alto.scale), block.text(alto.scale)) for block in alto.textblocks()]
+
+
+def vectorized(data):
+    return [(block.id, block.xywh, block.text()) for block in ocr.iter_textblocks(io.BytesIO(data), IMAGE_RESOLUTION)]
+
+
+def xpath_lookups(alto, ids):
+    for id in ids:
+        alto.xmldoc.xpath("//alto:TextBlock[@ID=$id]", id=id, namespaces=ocr.ns)[0]
+
+
+def index_lookups(alto, ids):
+    for id in ids:
+        alto.textblock(id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of ALTO text extraction.')
+    parser.add_argument('-b', '--blocks', help='Number of text blocks on the page (default 500).',
+                        type=int, default=500)
+    parser.add_argument('-n', '--repeat', help='Number of times to time each method (default 5).',
+                        type=int, default=5)
+    args = parser.parse_args()
+
+    data = synthetic_alto(args.blocks)
+    assert per_element(data) == vectorized(data)
+    strings = args.blocks * LINES_PER_BLOCK * STRINGS_PER_LINE
+    print(f'{args.blocks} text blocks, {strings} strings ({len(data) // 1024} KiB); best of {args.repeat}')
+
+    def report(results):
+        slow, fast = results.values()
+        for name, seconds in results.items():
+            print(f'{name:>14}: {seconds * 1000:8.2f} ms')
+        print(f'{"speed-up":>14}: {slow / fast:8.1f}x')
+
+    print('Text and coordinates of every block:')
+    report({
+        name: min(timeit.repeat(lambda: method(data), number=1, repeat=args.repeat))
+        for name, method in (('per element', per_element), ('vectorized', vectorized))
+    })
+
+    print('Lookup of every block by ID:')
+    ids = [f'TB{b}' for b in range(args.blocks)]
+    alto = ALTOResource(etree.parse(io.BytesIO(data)), IMAGE_RESOLUTION)
+    report({
+        name: min(timeit.repeat(lambda: method(alto, ids), number=1, repeat=args.repeat))
+        for name, method in (('XPath', xpath_lookups), ('ID index', index_lookups))
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the METS element lookups done by the NDNP handler: builds a
+   synthetic issue METS document, then looks up the dmdSec of every page, and
+   the file and techMD elements of every page file, the way
+   plastron.handlers.ndnp.Batch.create_page does. Compares the XPath searches
+   the handler used to do with METSResource's ID indexes.
+
+   optional arguments:
+   -h, --help               show this help message and exit
+   -p PAGES, --pages PAGES  Number of pages in the synthetic issue (default 100).
+   -n REPEAT, --repeat REPEAT
+                            Number of times to time each method (default 5)."""
+
+import argparse
+import os
+import sys
+import timeit
+import lxml.etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from plastron.handlers.ndnp import METSResource, xmlns  # noqa: E402
+
+# files per page in an NDNP issue, by USE
+FILE_USES = ['master', 'service', 'derivative', 'ocr']
+
+
+def synthetic_mets(pages):
+    m = '{' + xmlns['METS'] + '}'
+    root = lxml.etree.Element(m + 'mets', nsmap={'METS': xmlns['METS']})
+    dmdsecs = []
+    techmds = []
+    file_grp = lxml.etree.Element(m + 'fileGrp')
+    struct_div = lxml.etree.Element(m + 'div', TYPE='np:issue')
+    for n in range(1, pages + 1):
+        dmdsecs.append(lxml.etree.Element(m + 'dmdSec', ID=f'pageModsBib{n}'))
+        page_div = lxml.etree.SubElement(struct_div, m + 'div', TYPE='np:page', DMDID=f'pageModsBib{n}')
+        for use in FILE_USES:
+            file_id = f'{use}File{n}'
+            admids = [f'{use}Tech{n}', f'{use}Premis{n}']
+            techmds.extend(lxml.etree.Element(m + 'techMD', ID=admid) for admid in admids)
+            lxml.etree.SubElement(file_grp, m + 'file', ID=file_id, USE=use, ADMID=' '.join(admids))
+            lxml.etree.SubElement(page_div, m + 'fptr', FILEID=file_id)
+    root.extend(dmdsecs)
+    amd_sec = lxml.etree.SubElement(root, m + 'amdSec')
+    amd_sec.extend(techmds)
+    lxml.etree.SubElement(root, m + 'fileSec').append(file_grp)
+    lxml.etree.SubElement(root, m + 'structMap').append(struct_div)
+    return lxml.etree.ElementTree(root)
+
+
+class XPathMETSResource:
+    """The lookups as they were before METSResource indexed elements by ID"""
+    def __init__(self, xmldoc):
+        self.root = xmldoc.getroot()
+        self.xpath = lxml.etree.XPathElementEvaluator(self.root, namespaces=xmlns, smart_strings=False)
+
+    def dmdsec(self, id):
+        return self.xpath('METS:dmdSec[@ID=$id]', id=id)[0]
+
+    def file(self, id):
+        return self.xpath('METS:fileSec//METS:file[@ID=$id]', id=id)[0]
+
+    def techmd(self, id):
+        return self.xpath('METS:amdSec/METS:techMD[@ID=$id]', id=id)[0]
+
+
+def lookup_all(resource_class, tree):
+    issue_mets = resource_class(tree)
+    found = 0
+    for page_div in issue_mets.xpath('METS:structMap//METS:div[@TYPE="np:page"]'):
+        issue_mets.dmdsec(page_div.get('DMDID'))
+        for fptr in page_div.findall('METS:fptr', xmlns):
+            filexml = issue_mets.file(fptr.get('FILEID'))
+            for admid in filexml.get('ADMID').split():
+                issue_mets.techmd(admid)
+                found += 1
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of METS element lookups in the NDNP handler.')
+    parser.add_argument('-p', '--pages', help='Number of pages in the synthetic issue (default 100).',
+                        type=int, default=100)
+    parser.add_argument('-n', '--repeat', help='Number of times to time each method (default 5).',
+                        type=int, default=5)
+    args = parser.parse_args()
+
+    tree = synthetic_mets(args.pages)
+    assert lookup_all(XPathMETSResource, tree) == lookup_all(METSResource, tree)
+    print(f'{args.pages} pages, {len(FILE_USES)} files per page; best of {args.repeat}')
+
+    results = {}
+    for name, resource_class in (('XPath', XPathMETSResource), ('ID index', METSResource)):
+        results[name] = min(timeit.repeat(lambda: lookup_all(resource_class, tree), number=1, repeat=args.repeat))
+        print(f'{name:>10}: {results[name] * 1000:8.2f} ms')
+    print(f'   speed-up: {results["XPath"] / results["ID index"]:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ from plastron import commands, version
 from plastron.exceptions import FailureException
 from plastron.logging import DEFAULT_LOGGING_OPTIONS
 from plastron.http import Repository
+from plastron.util import DigestCache, LocalFile
 
 logger = logging.getLogger(__name__)
 now = datetime.utcnow().strftime('%Y%m%d%H%M%S')
@@ -77,6 +78,9 @@ def main():
             repo_config, ua_string='plastron/{0}'.format(version)
         )
 
+    if 'DIGEST_CACHE' in repo_config:
+        LocalFile.digest_cache = DigestCache(repo_config['DIGEST_CACHE'])
+
     # get basic logging options
     if 'LOGGING_CONFIG' in repo_config:
         with open(repo_config.get('LOGGING_CONFIG'), 'r') as logging_config_file:
@@ -110,6 +114,8 @@ def main():
         # dispatch to the selected subcommand
         print_header(args)
         command(fcrepo, args)
+        if fcrepo.cache is not None:
+            logger.debug(f'Graph cache statistics: {fcrepo.cache.stats()}')
         print_footer(args)
     except FailureException:
         # something failed, exit with non-zero status
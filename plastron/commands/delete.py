@@ -17,6 +17,12 @@ def configure_cli(subparsers):
         help='Delete additional objects found by traversing the given predicate(s)',
         action='store'
     )
+    parser.add_argument(
+        '--max-depth',
+        help='Stop traversing after following this many links from the starting objects',
+        action='store',
+        type=int
+    )
     parser.add_argument(
         '-d', '--dry-run',
         help='Simulate a delete without modifying the repository',
@@ -63,11 +69,12 @@ class Command:
         self.resources.process(
             method=self.delete_item,
             traverse=parse_predicate_list(args.recursive),
+            max_depth=args.max_depth,
             use_transaction=args.use_transactions
         )
 
     def delete_item(self, resource, graph):
-        if resource.uri in self.resources.completed:
+        if self.resources.completed is not None and resource.uri in self.resources.completed:
             logger.info(f'Resource {resource.uri} has already been deleted; skipping')
             return
         title = get_title_string(graph)
@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from plastron.exceptions import FailureException
+from plastron.util import DigestCache, LocalFile, compute_digests
+
+logger = logging.getLogger(__name__)
+
+# the SHAKE algorithms have a variable-length output, and need a length to produce a hex digest
+ALGORITHMS = sorted(a for a in hashlib.algorithms_guaranteed if not a.startswith('shake_'))
+
+
+def configure_cli(subparsers):
+    parser = subparsers.add_parser(
+        name='digest',
+        description='Compute the digests of local files ahead of a load and store them in the digest cache'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        help='number of files to hash at the same time; defaults to the number of CPUs',
+        action='store',
+        type=int,
+        default=os.cpu_count()
+    )
+    parser.add_argument(
+        '-a', '--algorithm',
+        help='digest algorithm to compute; may be repeated to compute several in one pass; defaults to sha1, '
+             'which is the one used by the load command',
+        action='append',
+        dest='algorithms',
+        choices=ALGORITHMS,
+        metavar='ALGORITHM'
+    )
+    parser.add_argument(
+        'paths',
+        nargs='+',
+        help='files or directories (searched recursively) to compute digests for'
+    )
+    parser.set_defaults(cmd_name='digest')
+
+
+def find_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def digest_file(cache, path, algorithms):
+    missing = [algorithm for algorithm in algorithms if cache.get(path, algorithm) is None]
+    if not missing:
+        return False
+    key = DigestCache.file_key(path)
+    for algorithm, digest in compute_digests(path, missing).items():
+        cache.put(path, digest, algorithm, key=key)
+    return True
+
+
+class Command:
+    def __call__(self, fcrepo, args):
+        if LocalFile.digest_cache is None:
+            logger.error('No digest cache configured; set DIGEST_CACHE in the repository configuration')
+            raise FailureException()
+
+        algorithms = args.algorithms or ['sha1']
+        logger.info(f"Computing {', '.join(algorithms)} digests with {args.workers} worker(s)")
+        counts = {'computed': 0, 'cached': 0, 'errors': 0}
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {
+                path: executor.submit(digest_file, LocalFile.digest_cache, path, algorithms)
+                for path in find_files(args.paths)
+            }
+            for path, future in futures.items():
+                try:
+                    if future.result():
+                        counts['computed'] += 1
+                        logger.debug(f'Computed digest for {path}')
+                    else:
+                        counts['cached'] += 1
+                        logger.debug(f'Digest for {path} is already cached')
+                except OSError as e:
+                    counts['errors'] += 1
+                    logger.error(f'Unable to compute digest for {path}: {e}')
+
+        logger.info(
+            f"Computed {counts['computed']} digest(s), {counts['cached']} already cached, "
+            f"{counts['errors']} error(s)"
+        )
+        if counts['errors'] > 0:
+            raise FailureException()
@@ -1,22 +1,32 @@
+import csv
 from datetime import datetime
+import hashlib
+import json
 import logging
 import os
 
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import NamedTemporaryFile
-from time import sleep
+from time import monotonic, sleep
+
+import requests
 
 from plastron import pcdm
 from plastron.daemon import Message
-from plastron.exceptions import ConfigException, DataReadException, RESTAPIException
+from plastron.exceptions import ConfigException, DataReadException, FailureException, RESTAPIException
 from plastron.logging import JSONLogMessage, STATUS_LOGGER
 from plastron.namespaces import get_manager
-from plastron.serializers import SERIALIZER_CLASSES
+from plastron.serializers import (
+    COMPRESSION_TYPES, SERIALIZER_CLASSES, CSVSerializer, detect_resource_class, get_main_subject
+)
 from plastron.util import LocalFile
 
 logger = logging.getLogger(__name__)
 nsm = get_manager()
 
+MANIFEST_FIELDS = ['uri', 'validator', 'model']
+
 
 def configure_cli(subparsers):
     parser = subparsers.add_parser(
@@ -35,11 +45,52 @@ def configure_cli(subparsers):
         choices=SERIALIZER_CLASSES.keys(),
         required=True
     )
+    parser.add_argument(
+        '--compression',
+        help='compress the export file as it is written; not available for CSV exports',
+        action='store',
+        choices=COMPRESSION_TYPES.keys()
+    )
     parser.add_argument(
         '--uri-template',
         help='Public URI template',
         action='store'
     )
+    parser.add_argument(
+        '--workers',
+        help='fetch up to N resources at the same time; defaults to the CONCURRENCY configured for the repository',
+        action='store',
+        type=int,
+        metavar='N'
+    )
+    parser.add_argument(
+        '--delay',
+        help='wait at least SECONDS between starting to fetch one resource and the next; defaults to 0',
+        action='store',
+        type=float,
+        default=0,
+        metavar='SECONDS'
+    )
+    parser.add_argument(
+        '--since-manifest',
+        help='only export resources that are new, or have changed, since the export that wrote this manifest',
+        action='store',
+        metavar='MANIFEST'
+    )
+    parser.add_argument(
+        '--write-manifest',
+        help='write a manifest of the current state of the exported resources to this file, '
+             'for use with --since-manifest in a later export',
+        action='store',
+        metavar='MANIFEST'
+    )
+    parser.add_argument(
+        '--merge-unchanged',
+        help='with --since-manifest, copy the rows of the resources that have not changed from this '
+             'earlier CSV export; only available for CSV exports',
+        action='store',
+        metavar='EXPORT_FILE'
+    )
     parser.add_argument(
         'uris',
         nargs='*',
@@ -59,46 +110,102 @@ class Command:
         except KeyError:
             raise ConfigException(f'Unknown format: {args.format}')
 
+        if args.merge_unchanged is not None:
+            if args.since_manifest is None:
+                raise ConfigException('Merging unchanged rows requires a manifest of an earlier export')
+            if not issubclass(serializer_class, CSVSerializer):
+                raise ConfigException('Merging unchanged rows is only available for CSV exports')
+
+        uris = args.uris
+        unchanged = []
+        validators = None
+        previous = {}
+        if args.since_manifest is not None or args.write_manifest is not None:
+            validators = get_validators(fcrepo, args.uris)
+        if args.since_manifest is not None:
+            if os.path.isfile(args.since_manifest):
+                previous = read_manifest(args.since_manifest)
+            else:
+                logger.warning(f'Manifest {args.since_manifest} does not exist; exporting everything')
+
+            def is_unchanged(uri):
+                return validators[uri] is not None and previous.get(uri, {}).get('validator') == validators[uri]
+
+            unchanged = [uri for uri in args.uris if is_unchanged(uri)]
+            uris = [uri for uri in args.uris if not is_unchanged(uri)]
+            logger.info(f'{len(unchanged)} of {total} items are unchanged since the export in {args.since_manifest}')
+        # content model names of the exported and unchanged resources, by URI
+        models = {uri: previous[uri]['model'] for uri in unchanged}
+
+        def update_status():
+            now = datetime.now().timestamp()
+            STATUS_LOGGER.info(JSONLogMessage({
+                'time': {
+                    'started': start_time,
+                    'now': now,
+                    'elapsed': now - start_time
+                },
+                'count': {
+                    'total': total,
+                    'exported': count,
+                    'errors': errors,
+                    'unchanged': len(unchanged)
+                }
+            }))
+
+        def fetch_failed(uri, e):
+            nonlocal errors
+            # log the failure, but continue to attempt to export the rest of the URIs
+            logger.error(f'Unable to retrieve {uri}: {e}')
+            errors += 1
+            update_status()
+
         logger.debug(f'Exporting to file {args.output_file}')
-        with serializer_class(args.output_file, public_uri_template=args.uri_template) as serializer:
-            for uri in args.uris:
-                r = fcrepo.head(uri)
-                if r.status_code == 200:
-                    # do export
-                    if 'describedby' in r.links:
-                        # the resource is a binary, get the RDF description URI
-                        rdf_uri = r.links['describedby']['url']
-                    else:
-                        rdf_uri = uri
-                    logger.info(f'Exporting item {count + 1}/{total}: {uri}')
-                    graph = fcrepo.get_graph(rdf_uri)
-                    try:
-                        serializer.write(graph)
-                        count += 1
-                    except DataReadException as e:
-                        # log the failure, but continue to attempt to export the rest of the URIs
-                        logger.error(f'Export of {uri} failed: {e}')
-                        errors += 1
-                    sleep(1)
-                else:
+        serializer_kwargs = {
+            'public_uri_template': args.uri_template,
+            'compression': args.compression
+        }
+        with serializer_class(args.output_file, **serializer_kwargs) as serializer:
+            # the descriptions are fetched concurrently, but come back in the
+            # original order, so they are all written by this one thread
+            resources = fcrepo.get_graphs(
+                throttle(uris, args.delay),
+                concurrency=args.workers,
+                ordered=True,
+                on_error=fetch_failed,
+                lightweight=True
+            )
+            for resource, graph in resources:
+                logger.info(f'Exporting item {count + errors + 1}/{len(uris)}: {resource.uri}')
+                try:
+                    serializer.write(graph)
+                    count += 1
+                    models[str(resource.uri)] = get_model_name(graph)
+                except DataReadException as e:
                     # log the failure, but continue to attempt to export the rest of the URIs
-                    logger.error(f'Unable to retrieve {uri}')
+                    logger.error(f'Export of {resource.uri} failed: {e}')
                     errors += 1
 
-                # update the status
-                now = datetime.now().timestamp()
-                STATUS_LOGGER.info(JSONLogMessage({
-                    'time': {
-                        'started': start_time,
-                        'now': now,
-                        'elapsed': now - start_time
-                    },
-                    'count': {
-                        'total': total,
-                        'exported': count,
-                        'errors': errors
-                    }
-                }))
+                update_status()
+
+            if args.merge_unchanged is not None:
+                try:
+                    merged = serializer.merge(
+                        args.merge_unchanged, unchanged, models=set(models[uri] for uri in unchanged) - {''}
+                    )
+                except DataReadException as e:
+                    logger.error(f'Unable to merge unchanged rows from {args.merge_unchanged}: {e}')
+                    raise FailureException(e.message)
+                logger.info(f'Merged {merged} unchanged rows from {args.merge_unchanged}')
+                if merged < len(set(unchanged)):
+                    logger.warning(f'{args.merge_unchanged} did not have rows for every unchanged item')
+
+        if args.write_manifest is not None:
+            # leave out anything that failed, so the next delta export tries it again
+            write_manifest(args.write_manifest, {
+                uri: {'validator': validators[uri], 'model': models[uri]}
+                for uri in args.uris if validators[uri] is not None and uri in models
+            })
 
         logger.info(f'Exported {count} of {total} items')
         return {
@@ -107,11 +214,93 @@ class Command:
             'count': {
                 'total': total,
                 'exported': count,
-                'errors': errors
+                'errors': errors,
+                'unchanged': len(unchanged)
             }
         }
 
 
+def throttle(uris, delay):
+    """Yields the given URIs no faster than one every delay seconds"""
+    next_time = monotonic()
+    for uri in uris:
+        if delay:
+            pause = next_time - monotonic()
+            if pause > 0:
+                sleep(pause)
+            next_time = monotonic() + delay
+        yield uri
+
+
+def get_validator(repository, uri):
+    """
+    A string that changes whenever the description of the resource at uri
+    changes, from the ETag (or Last-Modified) header of a HEAD response. For
+    binaries, the validator of the description is included as well. For
+    resources that cannot be retrieved, this is the HTTP status code. Returns
+    None if there is no usable header.
+    """
+    response = repository.head(uri)
+    if response.status_code != 200:
+        return str(response.status_code)
+    validator = response.headers.get('ETag', response.headers.get('Last-Modified'))
+    if validator is not None and 'describedby' in response.links:
+        description_validator = get_validator(repository, response.links['describedby']['url'])
+        if description_validator is None:
+            return None
+        validator += ' ' + description_validator
+    return validator
+
+
+def get_validators(repository, uris):
+    """The validators of the given URIs, by URI, from concurrent HEAD requests"""
+    uris = list(dict.fromkeys(uris))
+    with ThreadPoolExecutor(max_workers=repository.concurrency, thread_name_prefix='get_validators') as executor:
+        return dict(zip(uris, executor.map(lambda uri: get_validator(repository, uri), uris)))
+
+
+def read_manifest(filename):
+    """The validator and content model name recorded in an export manifest for each resource, by URI"""
+    with open(filename, 'r') as fh:
+        reader = csv.DictReader(fh)
+        if not reader.fieldnames == MANIFEST_FIELDS:
+            raise ConfigException(f'{filename} is not an export manifest')
+        return {row['uri']: {'validator': row['validator'], 'model': row['model']} for row in reader}
+
+
+def write_manifest(filename, entries):
+    with open(filename, 'w') as fh:
+        writer = csv.DictWriter(fh, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for uri, entry in entries.items():
+            writer.writerow({'uri': uri, **entry})
+
+
+def get_model_name(graph):
+    """The name of the content model of the resource the graph describes, or an empty string if it has none"""
+    try:
+        return detect_resource_class(graph, get_main_subject(graph)).__name__
+    except DataReadException:
+        return ''
+
+
+def export_key(repository, uris, export_format, uri_template=None):
+    """
+    Digest identifying the contents of an export of the given URIs in the
+    given format, as they are right now. Returns None if the state of any
+    resource cannot be determined, in which case the export cannot be cached.
+    """
+    try:
+        validators = get_validators(repository, uris)
+    except requests.RequestException as e:
+        logger.warning(f'Unable to check resources for the export cache: {e}')
+        return None
+    if None in validators.values():
+        return None
+    data = json.dumps([export_format, uri_template, sorted(validators.items())])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
 def process_message(listener, message_id, headers, body):
 
     # define the processor for this message
@@ -126,6 +315,25 @@ def process_message(listener, message_id, headers, body):
             logger.info(f'Requested export format is {export_format}')
 
             try:
+                key = None
+                if listener.export_cache is not None:
+                    key = export_key(listener.repository, uris, export_format, listener.public_uri_template)
+                    cached_uri = listener.export_cache.get(key) if key is not None else None
+                    if cached_uri is not None:
+                        if listener.repository.exists(cached_uri):
+                            logger.info(f'Nothing has changed since the export to {cached_uri}; reusing it')
+                            logger.info(f'Export job {job_id} complete')
+                            return Message(
+                                headers={
+                                    'ArchelonExportJobId': job_id,
+                                    'ArchelonExportJobStatus': 'Ready',
+                                    'ArchelonExportJobDownloadUrl': cached_uri,
+                                    'persistent': 'true'
+                                }
+                            )
+                        # the export file has been deleted since
+                        listener.export_cache.remove(key)
+
                 command = Command()
                 with NamedTemporaryFile() as export_fh:
                     logger.debug(f'Export temporary file name is {export_fh.name}')
@@ -133,7 +341,13 @@ def process_message(listener, message_id, headers, body):
                         uris=uris,
                         output_file=export_fh.name,
                         format=export_format,
-                        uri_template=listener.public_uri_template
+                        compression=None,
+                        uri_template=listener.public_uri_template,
+                        workers=None,
+                        delay=listener.export_delay,
+                        since_manifest=None,
+                        write_manifest=None,
+                        merge_unchanged=None
                     )
                     result = command(listener.repository, args)
 
@@ -146,6 +360,10 @@ def process_message(listener, message_id, headers, body):
                         logger.info(f'Uploaded export file to {file.uri}')
 
                     logger.debug(f'Export temporary file size is {os.path.getsize(export_fh.name)}')
+                # an export with errors is missing some of the resources, so it
+                # must not be handed out again for the same request
+                if key is not None and result['count']['errors'] == 0:
+                    listener.export_cache.put(key, file.uri)
                 logger.info(f'Export job {job_id} complete')
                 return Message(
                     headers={
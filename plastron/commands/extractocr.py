@@ -1,7 +1,10 @@
 import logging
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-from plastron import util
+from plastron import oa, util
+from plastron.util import check_interrupted, finished_results
 from plastron.exceptions import RESTAPIException, DataReadException, FailureException
 from plastron.models.newspaper import Page
 from plastron.http import Transaction
@@ -20,6 +23,20 @@ def configure_cli(subparsers):
         help='file listing items to ignore',
         action='store'
     )
+    parser.add_argument(
+        '--annotation-lists',
+        help='create one annotation list resource for each page, holding all of its annotations, '
+             'instead of a separate resource for each text block',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--workers',
+        help='extract the OCR of up to N pages at the same time, each in its own transaction; defaults to 1',
+        action='store',
+        type=int,
+        default=1,
+        metavar='N'
+    )
     parser.set_defaults(cmd_name='extractocr')
 
 
@@ -29,7 +46,7 @@ class Command:
 
         # read the log of completed items
         try:
-            completed = util.ItemLog('logs/annotated.csv', fieldnames, 'uri')
+            completed = util.open_item_log('logs/annotated.csv', fieldnames, 'uri')
         except Exception as e:
             logger.error('Non-standard map file specified: {0}'.format(e))
             raise FailureException()
@@ -38,7 +55,7 @@ class Command:
 
         if args.ignore is not None:
             try:
-                ignored = util.ItemLog(args.ignore, fieldnames, 'uri')
+                ignored = util.open_item_log(args.ignore, fieldnames, 'uri')
             except Exception as e:
                 logger.error('Non-standard ignore file specified: {0}'.format(e))
                 raise FailureException()
@@ -46,46 +63,121 @@ class Command:
             ignored = []
 
         skipfile = 'logs/skipped.extractocr.{0}.csv'.format(now)
-        skipped = util.ItemLog(skipfile, fieldnames, 'uri')
-
-        with fcrepo.at_path('/annotations'):
-            for line in sys.stdin:
-                uri = line.rstrip('\n')
-                if uri in completed:
-                    continue
-                elif uri in ignored:
-                    logger.debug('Ignoring {0}'.format(uri))
-                    continue
-
-                try:
-                    is_extracted = extract(fcrepo, uri)
-                except RESTAPIException:
-                    logger.error(
-                        "Unable to commit or rollback transaction, aborting"
-                    )
-                    raise FailureException()
-
-                row = {
-                    'uri': uri,
-                    'timestamp': str(datetime.utcnow())
-                }
-
-                if is_extracted:
-                    completed.writerow(row)
-                else:
-                    skipped.writerow(row)
-
-
-def extract(fcrepo, uri):
+        skipped = util.open_item_log(skipfile, fieldnames, 'uri')
+
+        uris = select_uris((line.rstrip('\n') for line in sys.stdin), completed, ignored)
+        results = ResultLog(completed, skipped)
+        if args.workers > 1:
+            extract_in_parallel(fcrepo, uris, args, results)
+        else:
+            with fcrepo.at_path('/annotations'):
+                for uri in uris:
+                    results.add(uri, extract_page(fcrepo, uri, args))
+
+
+def select_uris(uris, completed, ignored):
+    for uri in uris:
+        if uri in completed:
+            continue
+        elif uri in ignored:
+            logger.debug('Ignoring {0}'.format(uri))
+            continue
+        yield uri
+
+
+def extract_page(fcrepo, uri, args, interrupted=None):
+    try:
+        return extract(fcrepo, uri, annotation_lists=args.annotation_lists, interrupted=interrupted)
+    except RESTAPIException:
+        logger.error(
+            "Unable to commit or rollback transaction, aborting"
+        )
+        raise FailureException()
+
+
+def extract_in_parallel(fcrepo, uris, args, results):
+    """
+    Extract the OCR of up to args.workers pages at the same time, each through
+    its own clone of the repository so that each one runs in its own
+    transaction. If interrupted, the pages in progress stop and roll back
+    their own transactions before the interrupt is raised again. Pages that
+    finish after extraction has stopped, for whatever reason, are still
+    recorded, since their annotations were committed.
+    """
+    interrupted = threading.Event()
+
+    def run(uri):
+        repository = fcrepo.clone()
+        with repository.at_path('/annotations'):
+            return extract_page(repository, uri, args, interrupted)
+
+    futures = {}
+
+    def collect(return_when):
+        done, _ = wait(futures, return_when=return_when)
+        for future in done:
+            results.add(futures.pop(future), future.result())
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        for uri in uris:
+            if len(futures) >= args.workers:
+                collect(FIRST_COMPLETED)
+            futures[executor.submit(run, uri)] = uri
+        while futures:
+            collect(FIRST_COMPLETED)
+    except KeyboardInterrupt as e:
+        logger.error("OCR extraction interrupted")
+        interrupted.set()
+        raise e
+    finally:
+        # stop starting new pages, but let the ones in progress finish
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for uri, is_extracted in finished_results(futures):
+            results.add(uri, is_extracted)
+
+
+class ResultLog:
+    """Records each page in the completed log if its OCR was extracted, or in the skipped log if not"""
+    def __init__(self, completed, skipped):
+        self.completed = completed
+        self.skipped = skipped
+
+    def add(self, uri, is_extracted):
+        row = {
+            'uri': uri,
+            'timestamp': str(datetime.utcnow())
+        }
+
+        if is_extracted:
+            self.completed.writerow(row)
+        else:
+            self.skipped.writerow(row)
+
+
+def extract(fcrepo, uri, annotation_lists=False, interrupted=None):
+    """
+    Create the annotations for the page at uri in a transaction. If the
+    interrupted event is set before they are all created, the transaction
+    is rolled back and KeyboardInterrupt is raised.
+    """
     with Transaction(fcrepo) as txn:
         try:
             logger.info("Getting {0} from repository".format(uri))
-            page = Page.from_repository(fcrepo, uri)
+            # only the OCR and master files are needed to create the annotations
+            page = Page.from_repository(fcrepo, uri, uses=('ocr', 'master'))
             logger.info("Creating annotations for page {0}".format(page.title))
-            for annotation in page.textblocks():
+            annotations = page.textblocks()
+            if annotation_lists:
+                annotations = oa.group_annotations(annotations)
+            for annotation in annotations:
+                check_interrupted(interrupted)
                 annotation.create_object(fcrepo)
                 annotation.update_object(fcrepo)
 
+            check_interrupted(interrupted)
             txn.commit()
             return True
 
@@ -97,3 +189,9 @@ def extract(fcrepo, uri):
             logger.error("OCR extraction failed: {0}".format(e))
             txn.rollback()
             logger.warning('Transaction rolled back. Continuing load.')
+
+        except KeyboardInterrupt as e:
+            logger.error(f'OCR extraction for {uri} interrupted')
+            txn.rollback()
+            logger.warning('Transaction rolled back.')
+            raise e
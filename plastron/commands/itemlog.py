@@ -0,0 +1,64 @@
+import csv
+import logging
+import os
+from plastron.exceptions import FailureException
+from plastron.util import SQLiteItemLog
+
+logger = logging.getLogger(__name__)
+
+
+def configure_cli(subparsers):
+    parser = subparsers.add_parser(
+        name='itemlog',
+        description='Convert an item log (such as a load map file, or the completed log of an update or delete) '
+                    'between CSV and SQLite'
+    )
+    direction = parser.add_mutually_exclusive_group(required=True)
+    direction.add_argument(
+        '--import',
+        help='add the rows of the CSV item log CSV_FILE to the SQLite item log',
+        dest='import_file',
+        metavar='CSV_FILE'
+    )
+    direction.add_argument(
+        '--export',
+        help='write the rows of the SQLite item log to the CSV item log CSV_FILE',
+        dest='export_file',
+        metavar='CSV_FILE'
+    )
+    parser.add_argument(
+        '-k', '--key',
+        help='field that identifies the items, when importing into a new SQLite item log; '
+             'defaults to "path" if the CSV file has that field, otherwise "uri"',
+        action='store'
+    )
+    parser.add_argument(
+        'log',
+        help='SQLite item log file'
+    )
+    parser.set_defaults(cmd_name='itemlog')
+
+
+class Command:
+    def __call__(self, fcrepo, args):
+        try:
+            if args.import_file is not None:
+                with open(args.import_file, 'r') as fh:
+                    fieldnames = csv.DictReader(fh).fieldnames
+                if os.path.isfile(args.log):
+                    keyfield = SQLiteItemLog.schema(args.log)[1]
+                elif args.key is not None:
+                    keyfield = args.key
+                else:
+                    keyfield = 'path' if 'path' in fieldnames else 'uri'
+                log = SQLiteItemLog(args.log, fieldnames, keyfield, batch_size=10000)
+                log.import_csv(args.import_file)
+                logger.info(f'Imported {args.import_file} into {args.log}, which now has {len(log)} item(s)')
+            else:
+                fieldnames, keyfield = SQLiteItemLog.schema(args.log)
+                log = SQLiteItemLog(args.log, fieldnames, keyfield)
+                log.export_csv(args.export_file)
+                logger.info(f'Exported {len(log)} item(s) from {args.log} to {args.export_file}')
+        except Exception as e:
+            logger.error(f'Unable to convert item log: {e}')
+            raise FailureException()
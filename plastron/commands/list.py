@@ -21,6 +21,12 @@ def configure_cli(subparsers):
         help='List additional objects found by traversing the given predicate(s)',
         action='store'
     )
+    parser.add_argument(
+        '--max-depth',
+        help='Stop traversing after following this many links from the starting objects',
+        action='store',
+        type=int
+    )
     parser.add_argument(
         'uris', nargs='*',
         help='URIs of repository objects to list'
@@ -40,6 +46,7 @@ class Command:
         resources.process(
             method=self.list_item,
             traverse=parse_predicate_list(args.recursive),
+            max_depth=args.max_depth,
             use_transaction=False
         )
 
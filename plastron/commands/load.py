@@ -1,18 +1,27 @@
 import logging.config
 import os
 import re
+import threading
+import requests
 import yaml
 from argparse import ArgumentTypeError
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 from importlib import import_module
 from time import sleep
+from rdflib import URIRef
+from plastron import ldp, oa, pcdm
 from plastron.exceptions import ConfigException, DataReadException, RESTAPIException, FailureException
 from plastron.http import Transaction
-from plastron.util import ItemLog
+from plastron.scheduler import WriteScheduler
+from plastron.util import ExternalContent, LocalFile, check_interrupted, finished_results, open_item_log
 
 logger = logging.getLogger(__name__)
 now = datetime.utcnow().strftime('%Y%m%d%H%M%S')
 
+BINARIES_MANIFEST_FIELDS = ['item', 'uri', 'path', 'mimetype', 'filename', 'digest']
+
 
 def configure_cli(subparsers):
     parser = subparsers.add_parser(
@@ -59,6 +68,12 @@ def configure_cli(subparsers):
         action='store_false',
         dest='create_annotations'
     )
+    parser.add_argument(
+        '--annotation-lists',
+        help='create one annotation list resource for each page, holding all of its annotations, '
+             'instead of a separate resource for each annotation',
+        action='store_true'
+    )
     parser.add_argument(
         '--no-transactions', '--no-txn',
         help='run the load without using transactions',
@@ -70,6 +85,54 @@ def configure_cli(subparsers):
         help='file listing items to ignore',
         action='store'
     )
+    parser.add_argument(
+        '--create-with-rdf',
+        help='send the RDF description of each resource in the same request that creates it',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--concurrent-writes',
+        help='send up to N independent create and update requests for an item at the same time; defaults to 1',
+        action='store',
+        type=int,
+        default=1,
+        metavar='N'
+    )
+    parser.add_argument(
+        '--defer-binaries',
+        help='create empty placeholders for local binary files and list them in the binaries manifest, '
+             'so they can be uploaded later with --binaries-only',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--binaries-only',
+        help='upload the binaries listed in the binaries manifest for the items in the map file, '
+             'replacing the placeholders created by --defer-binaries',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--workers',
+        help='load up to N items (or with --binaries-only, N binaries) at the same time, '
+             'each item in its own transaction; defaults to 1',
+        action='store',
+        type=int,
+        default=1,
+        metavar='N'
+    )
+    parser.add_argument(
+        '--in-order',
+        help='when loading items in parallel, write the map file in batch order instead of as items finish',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--read-ahead',
+        help='read the data for up to N upcoming items in the background while the current items load; '
+             'handlers that support it do this in separate processes',
+        action='store',
+        type=int,
+        default=0,
+        metavar='N'
+    )
     parser.add_argument(
         '--wait', '-w',
         help='wait n seconds between items',
@@ -94,7 +157,25 @@ class Command:
         if not os.path.isdir(batch_config.log_dir):
             os.makedirs(batch_config.log_dir)
 
+        if args.binaries_only:
+            if not args.dry_run:
+                fcrepo.test_connection()
+                load_deferred_binaries(fcrepo, batch_config, args)
+            return
+
         fcrepo.load_binaries = args.load_binaries
+        fcrepo.create_with_rdf = args.create_with_rdf
+        fcrepo.defer_binaries = args.defer_binaries
+        if batch_config.external_content_url is not None:
+            logger.info(
+                f'Binaries in {batch_config.external_content_path} will be loaded as external content '
+                f'from {batch_config.external_content_url}'
+            )
+            fcrepo.external_content = ExternalContent(
+                batch_config.external_content_path,
+                batch_config.external_content_url,
+                verify_digest=batch_config.verify_external_content
+            )
 
         # Define the data_handler function for the data being loaded
         logger.info("Initializing data handler")
@@ -120,7 +201,8 @@ class Command:
             # read the log of completed items
             fieldnames = ['number', 'timestamp', 'title', 'path', 'uri']
             try:
-                completed = ItemLog(batch_config.mapfile, fieldnames, 'path')
+                # write each completed item straight away, since a lost row means loading that item twice
+                completed = open_item_log(batch_config.mapfile, fieldnames, 'path', batch_size=1)
             except Exception as e:
                 logger.error(f"Non-standard map file specified: {e}")
                 raise FailureException()
@@ -129,7 +211,7 @@ class Command:
 
             if args.ignore is not None:
                 try:
-                    ignored = ItemLog(args.ignore, fieldnames, 'path')
+                    ignored = open_item_log(args.ignore, fieldnames, 'path')
                 except Exception as e:
                     logger.error(f"Non-standard ignore file specified: {e}")
                     raise FailureException()
@@ -139,61 +221,211 @@ class Command:
             skipfile = os.path.join(
                 batch_config.log_dir, 'skipped.load.{0}.csv'.format(now)
             )
-            skipped = ItemLog(skipfile, fieldnames, 'path')
-
-            load_set = get_load_set(batch, args.percent)
-
-            # create all batch objects in repository
-            for n, item in enumerate(batch):
-                is_loaded = False
-
-                if n not in load_set:
-                    logger.info(f"Loading {args.percent}, skipping item {n}")
-                    continue
-
-                # handle load limit parameter
-                if args.limit is not None and n >= args.limit:
-                    logger.info(f"Stopping after {args.limit} item(s)")
-                    break
-                elif item.path in completed:
-                    continue
-                elif item.path in ignored:
-                    logger.debug(f"Ignoring {item.path}")
-                    continue
-
-                logger.info(f"Processing item {n + 1}/{batch.length}...")
-
-                try:
-                    logger.info(f"Loading item {n + 1}")
-                    is_loaded = load_item(
-                        fcrepo, item, args, extra=batch_config.extra
-                    )
-                except RESTAPIException:
-                    logger.error(
-                        "Unable to commit or rollback transaction, aborting"
-                    )
-                    raise FailureException()
-                except DataReadException as e:
-                    logger.error(f"Skipping item {n + 1}: {e.message}")
+            skipped = open_item_log(skipfile, fieldnames, 'path')
 
-                row = {'number': n + 1,
-                       'path': item.path,
-                       'timestamp': getattr(
-                           item, 'creation_timestamp', str(datetime.utcnow())
-                       ),
-                       'title': getattr(item, 'title', 'N/A'),
-                       'uri': getattr(item, 'uri', 'N/A')
-                       }
-
-                # write item details to relevant summary CSV
-                if is_loaded:
-                    completed.writerow(row)
-                else:
-                    skipped.writerow(row)
+            if args.defer_binaries:
+                manifest = open_item_log(batch_config.binaries_manifest, BINARIES_MANIFEST_FIELDS, 'uri', batch_size=1)
+            else:
+                manifest = None
 
-                if args.wait:
-                    logger.info("Pausing {0} seconds".format(args.wait))
-                    sleep(int(args.wait))
+            load_set = get_load_set(batch, args.percent)
+            items = select_items(batch, load_set, args, completed, ignored)
+            if args.read_ahead > 0:
+                use_processes = getattr(handler, 'PICKLABLE_ITEMS', False)
+                items = ReadAhead(items, args.read_ahead, use_processes=use_processes)
+            results = ResultLog(completed, skipped, ordered=args.in_order)
+
+            if args.workers > 1:
+                load_items_in_parallel(fcrepo, items, args, batch_config.extra, results, manifest)
+            else:
+                for seq, (n, item) in enumerate(items):
+                    logger.info(f"Processing item {n + 1}/{batch.length}...")
+                    is_loaded = load_batch_item(fcrepo, n, item, args, batch_config.extra, manifest)
+                    results.add(seq, n, item, is_loaded)
+
+                    if args.wait:
+                        logger.info("Pausing {0} seconds".format(args.wait))
+                        sleep(int(args.wait))
+
+
+def select_items(batch, load_set, args, completed, ignored):
+    """Generator of (index, item) pairs for the batch items that should be loaded"""
+    for n, item in enumerate(batch):
+        if n not in load_set:
+            logger.info(f"Loading {args.percent}, skipping item {n}")
+            continue
+
+        # handle load limit parameter
+        if args.limit is not None and n >= args.limit:
+            logger.info(f"Stopping after {args.limit} item(s)")
+            break
+        elif item.path in completed:
+            continue
+        elif item.path in ignored:
+            logger.debug(f"Ignoring {item.path}")
+            continue
+
+        yield n, item
+
+
+class ReadAhead:
+    """
+    Wraps an iterator of (index, batch item) pairs, running read_data() for the
+    next few batch items in the background so that their data is ready by the
+    time the loader gets to them. If use_processes is true, the items are read in
+    a process pool, which requires that the batch items and the objects they
+    read can be pickled; otherwise they are read in a thread pool.
+    """
+    def __init__(self, items, depth, use_processes=False):
+        self.items = iter(items)
+        self.depth = depth
+        self.use_processes = use_processes
+        self.queue = deque()
+
+    def __iter__(self):
+        if self.use_processes:
+            executor = ProcessPoolExecutor(max_workers=self.depth)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.depth)
+        logger.info(f'Reading up to {self.depth} item(s) ahead using {executor.__class__.__name__}')
+        try:
+            while True:
+                # keep the queue topped up; this also bounds the number of
+                # finished items waiting in memory
+                while len(self.queue) < self.depth:
+                    try:
+                        n, batch_item = next(self.items)
+                    except StopIteration:
+                        break
+                    self.queue.append((n, PrefetchedItem(batch_item, executor.submit(batch_item.read_data))))
+                if not self.queue:
+                    return
+                yield self.queue.popleft()
+        finally:
+            for _, item in self.queue:
+                item.future.cancel()
+            self.queue.clear()
+            executor.shutdown(wait=True)
+
+
+class PrefetchedItem:
+    """A batch item whose read_data() returns the result of a read that was started earlier"""
+    def __init__(self, batch_item, future):
+        self.batch_item = batch_item
+        self.future = future
+
+    def read_data(self):
+        return self.future.result()
+
+    def __getattr__(self, name):
+        return getattr(self.batch_item, name)
+
+
+def load_batch_item(fcrepo, n, item, args, extra=None, manifest=None, interrupted=None):
+    try:
+        logger.info(f"Loading item {n + 1}")
+        return load_item(fcrepo, item, args, extra=extra, manifest=manifest, interrupted=interrupted)
+    except RESTAPIException:
+        logger.error(
+            "Unable to commit or rollback transaction, aborting"
+        )
+        raise FailureException()
+    except DataReadException as e:
+        logger.error(f"Skipping item {n + 1}: {e.message}")
+        return False
+
+
+def load_items_in_parallel(fcrepo, items, args, extra, results, manifest=None):
+    """
+    Load up to args.workers items at the same time, each through its own clone
+    of the repository so that each one runs in its own transaction. If the load
+    is interrupted, the items in progress stop and roll back their own
+    transactions. Items that finish after the load has stopped, for whatever
+    reason, are still recorded, since they were committed.
+    """
+    interrupted = threading.Event()
+
+    def load(n, item):
+        return load_batch_item(fcrepo.clone(), n, item, args, extra, manifest, interrupted)
+
+    futures = {}
+
+    def collect(return_when):
+        done, _ = wait(futures, return_when=return_when)
+        for future in done:
+            seq, n, item = futures.pop(future)
+            results.add(seq, n, item, future.result())
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        for seq, (n, item) in enumerate(items):
+            if len(futures) >= args.workers:
+                collect(FIRST_COMPLETED)
+            logger.info(f"Processing item {n + 1}...")
+            futures[executor.submit(load, n, item)] = (seq, n, item)
+
+            if args.wait:
+                logger.info("Pausing {0} seconds".format(args.wait))
+                sleep(int(args.wait))
+        while futures:
+            collect(FIRST_COMPLETED)
+    except KeyboardInterrupt as e:
+        logger.error("Load interrupted")
+        interrupted.set()
+        raise e
+    finally:
+        # stop starting new items, but let the ones in progress finish
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for (seq, n, item), is_loaded in finished_results(futures):
+            results.add(seq, n, item, is_loaded)
+        results.flush()
+
+
+class ResultLog:
+    """
+    Records each loaded item in the completed log, and each item that failed in
+    the skipped log. Items are numbered in the order they were started; if
+    ordered is true, they are written in that order even if they finish out of
+    order, otherwise they are written as soon as they finish.
+    """
+    def __init__(self, completed, skipped, ordered=False):
+        self.completed = completed
+        self.skipped = skipped
+        self.ordered = ordered
+        self.pending = {}
+        self.next_seq = 0
+
+    def add(self, seq, n, item, is_loaded):
+        if not self.ordered:
+            self.write(n, item, is_loaded)
+            return
+        self.pending[seq] = (n, item, is_loaded)
+        while self.next_seq in self.pending:
+            self.write(*self.pending.pop(self.next_seq))
+            self.next_seq += 1
+
+    def flush(self):
+        # write out anything still waiting on an item that never finished
+        for seq in sorted(self.pending):
+            self.write(*self.pending.pop(seq))
+
+    def write(self, n, item, is_loaded):
+        row = {'number': n + 1,
+               'path': item.path,
+               'timestamp': getattr(
+                   item, 'creation_timestamp', str(datetime.utcnow())
+               ),
+               'title': getattr(item, 'title', 'N/A'),
+               'uri': getattr(item, 'uri', 'N/A')
+               }
+
+        # write item details to relevant summary CSV
+        if is_loaded:
+            self.completed.writerow(row)
+        else:
+            self.skipped.writerow(row)
 
 
 def get_load_set(batch, percent=None):
@@ -216,51 +448,89 @@ def percentage(n):
     return p
 
 
-def load_item_internal(fcrepo, item, args, extra=None):
+def load_item_internal(fcrepo, item, args, extra=None, interrupted=None):
+    if args.create_annotations and args.annotation_lists:
+        item.annotations = oa.group_annotations(item.annotations)
+    if fcrepo.mint_uris:
+        logger.info('Minting URIs')
+        item.recursive_mint(fcrepo)
+    if args.concurrent_writes > 1:
+        return load_item_concurrently(fcrepo, item, args, extra, interrupted)
+
     logger.info('Creating item')
     item.recursive_create(fcrepo)
+    check_interrupted(interrupted)
     logger.info('Creating ordering proxies')
     item.create_proxies(fcrepo)
     if args.create_annotations:
+        check_interrupted(interrupted)
         logger.info('Creating annotations')
         item.create_annotations(fcrepo)
 
     if extra:
-        logger.info('Adding additional triples')
-        if re.search(r'\.(ttl|n3|nt)$', extra):
-            rdf_format = 'n3'
-        elif re.search(r'\.(rdf|xml)$', extra):
-            rdf_format = 'xml'
-        else:
-            raise ConfigException("Unrecognized extra triples file format")
-        item.add_extra_properties(extra, rdf_format)
+        add_extra_triples(item, extra)
 
+    check_interrupted(interrupted)
     logger.info('Updating item and components')
     item.recursive_update(fcrepo)
     if args.create_annotations:
+        check_interrupted(interrupted)
         logger.info('Updating annotations')
         item.update_annotations(fcrepo)
 
 
-def load_item(fcrepo, batch_item, args, extra=None):
+def load_item_concurrently(fcrepo, item, args, extra=None, interrupted=None):
+    scheduler = WriteScheduler(fcrepo, width=args.concurrent_writes)
+    if extra:
+        def before_update(obj):
+            add_extra_triples(obj, extra)
+    else:
+        before_update = None
+
+    logger.info('Creating and updating item, components, and ordering proxies')
+    scheduler.write(item, before_update=before_update)
+    if args.create_annotations:
+        check_interrupted(interrupted)
+        # annotations are created in a different container, so they get their own pass
+        logger.info('Creating and updating annotations')
+        with fcrepo.at_path('annotations'):
+            scheduler.write(*item.annotations)
+
+
+def add_extra_triples(item, extra):
+    logger.info('Adding additional triples')
+    if re.search(r'\.(ttl|n3|nt)$', extra):
+        rdf_format = 'n3'
+    elif re.search(r'\.(rdf|xml)$', extra):
+        rdf_format = 'xml'
+    else:
+        raise ConfigException("Unrecognized extra triples file format")
+    item.add_extra_properties(extra, rdf_format)
+
+
+def load_item(fcrepo, batch_item, args, extra=None, manifest=None, interrupted=None):
     # read data for item
     logger.info('Reading item data')
     item = batch_item.read_data()
+    check_interrupted(interrupted)
 
     if args.use_transactions:
         # open transaction
         with Transaction(fcrepo, keep_alive=90) as txn:
             # create item and its components
             try:
-                load_item_internal(fcrepo, item, args, extra)
+                load_item_internal(fcrepo, item, args, extra, interrupted)
+                check_interrupted(interrupted)
 
                 # commit transaction
                 txn.commit()
+                if manifest is not None:
+                    record_deferred_binaries(manifest, batch_item, item)
                 logger.info('Performing post-creation actions')
                 item.post_creation_hook()
                 return True
 
-            except (RESTAPIException, FileNotFoundError) as e:
+            except (RESTAPIException, DataReadException, FileNotFoundError) as e:
                 # if anything fails during item creation or committing the transaction
                 # attempt to rollback the current transaction
                 # failures here will be caught by the main loop's exception handler
@@ -271,12 +541,16 @@ def load_item(fcrepo, batch_item, args, extra=None):
 
             except KeyboardInterrupt as e:
                 logger.error("Load interrupted")
+                txn.rollback()
+                logger.warning('Transaction rolled back.')
                 raise e
     else:
         try:
-            load_item_internal(fcrepo, item, args, extra)
+            load_item_internal(fcrepo, item, args, extra, interrupted)
+            if manifest is not None:
+                record_deferred_binaries(manifest, batch_item, item)
             return True
-        except (RESTAPIException, FileNotFoundError) as e:
+        except (RESTAPIException, DataReadException, FileNotFoundError) as e:
             logger.error("Item creation failed: {0}".format(e))
             logger.warning('Continuing load.')
         except KeyboardInterrupt as e:
@@ -284,6 +558,128 @@ def load_item(fcrepo, batch_item, args, extra=None):
             raise e
 
 
+def record_deferred_binaries(manifest, batch_item, item):
+    """
+    Add the binaries of an item that were created as placeholders to the
+    manifest. Only called once the item has been committed, so that the
+    binaries pass never writes to URIs that were rolled back.
+    """
+    for file in find_files(item):
+        if file.deferred:
+            manifest.writerow({
+                'item': batch_item.path,
+                'uri': str(file.uri),
+                'path': file.source.localpath,
+                'mimetype': file.source.mimetype(),
+                'filename': file.source.filename,
+                'digest': file.source.precomputed_digest()
+            })
+
+
+def find_files(item):
+    """Generator of all the pcdm.File objects linked to, directly or indirectly, from the item"""
+    seen = set()
+    queue = deque([item])
+    while queue:
+        obj = queue.popleft()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, pcdm.File):
+            yield obj
+        queue.extend(o for o in obj.linked_objects() if isinstance(o, ldp.Resource))
+
+
+def load_deferred_binaries(fcrepo, batch_config, args):
+    """
+    Second pass of a --defer-binaries load: upload the content of each binary in
+    the manifest to the placeholder created for it, for every item that has
+    been completed, skipping binaries that were already uploaded.
+    """
+    fieldnames = ['number', 'timestamp', 'title', 'path', 'uri']
+    try:
+        completed = open_item_log(batch_config.mapfile, fieldnames, 'path')
+        manifest = open_item_log(batch_config.binaries_manifest, BINARIES_MANIFEST_FIELDS, 'uri')
+    except Exception as e:
+        logger.error(f"Non-standard map file or binaries manifest: {e}")
+        raise FailureException()
+    loaded = open_item_log(loaded_log_name(batch_config.binaries_manifest), BINARIES_MANIFEST_FIELDS, 'uri')
+
+    rows = [row for row in manifest if row['item'] in completed and row['uri'] not in loaded]
+    logger.info(f'Found {len(manifest)} binaries in the manifest, {len(rows)} waiting to be uploaded')
+    if args.limit is not None:
+        rows = rows[:args.limit]
+
+    fcrepo.load_binaries = True
+
+    def upload(row):
+        source = LocalFile(
+            row['path'], mimetype=row['mimetype'], filename=row['filename'], digest=row['digest'] or None
+        )
+        file = pcdm.File(source)
+        file.uri = URIRef(row['uri'])
+        response = file.upload(fcrepo, file.uri)
+        if response.status_code not in (201, 204):
+            raise RESTAPIException(response)
+        if not file.digest_verified:
+            file.verify_digest(fcrepo.head(file.uri, headers={'Want-Digest': 'sha'}))
+        return file
+
+    uploaded = 0
+    failures = 0
+
+    def record(row, future):
+        nonlocal uploaded, failures
+        try:
+            future.result()
+        except (RESTAPIException, DataReadException, OSError, requests.RequestException) as e:
+            failures += 1
+            logger.error(f"Unable to upload {row['path']} to {row['uri']}: {e}")
+        else:
+            uploaded += 1
+            loaded.writerow(row)
+            logger.info(f"Uploaded {row['path']} to {row['uri']}")
+
+    futures = {}
+
+    def collect(return_when):
+        done, _ = wait(futures, return_when=return_when)
+        for future in done:
+            record(futures.pop(future), future)
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        for row in rows:
+            if len(futures) >= args.workers:
+                collect(FIRST_COMPLETED)
+            futures[executor.submit(upload, row)] = row
+        while futures:
+            collect(FIRST_COMPLETED)
+    except KeyboardInterrupt as e:
+        logger.error("Upload of binaries interrupted")
+        raise e
+    finally:
+        # stop starting new uploads, but let the ones in progress finish, and
+        # record them so that resuming the load does not upload them again
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for row, _ in finished_results(futures):
+            uploaded += 1
+            loaded.writerow(row)
+        loaded.close()
+
+    logger.info(f'Uploaded {uploaded} binaries, {failures} failed')
+    if failures > 0:
+        raise FailureException()
+
+
+def loaded_log_name(manifest_filename):
+    # binaries.csv -> binaries.loaded.csv, binaries.sqlite -> binaries.loaded.sqlite
+    base, ext = os.path.splitext(manifest_filename)
+    return base + '.loaded' + ext
+
+
 class BatchConfig:
     def __init__(self, filename):
         self.filename = filename
@@ -299,9 +695,22 @@ class BatchConfig:
         # mapfile defaults to <log_dir>/mapfile.csv
         self.mapfile = os.path.join(self.log_dir, options.get('MAPFILE', 'mapfile.csv'))
 
+        # binaries_manifest defaults to <log_dir>/binaries.csv
+        self.binaries_manifest = os.path.join(self.log_dir, options.get('BINARIES_MANIFEST', 'binaries.csv'))
+
         self.handler_options = options.get('HANDLER_OPTIONS', {})
         self.extra = options.get('EXTRA', None)
 
+        # optionally create binaries as references to where the repository can
+        # already reach them, instead of uploading them; external_content_path
+        # defaults to the data_dir
+        self.external_content_url = options.get('EXTERNAL_CONTENT_URL', None)
+        if 'EXTERNAL_CONTENT_PATH' in options:
+            self.external_content_path = os.path.join(self.root_dir, options['EXTERNAL_CONTENT_PATH'])
+        else:
+            self.external_content_path = self.data_dir
+        self.verify_external_content = bool(options.get('VERIFY_EXTERNAL_CONTENT', False))
+
         # required fields
         missing_fields = []
         try:
@@ -17,6 +17,7 @@ from stomp.exception import ConnectFailedException
 from plastron import version
 from plastron.http import Repository
 from plastron.logging import DEFAULT_LOGGING_OPTIONS, STOMPHandler, STATUS_LOGGER
+from plastron.util import ExportCache
 
 logger = logging.getLogger(__name__)
 now = datetime.utcnow().strftime('%Y%m%d%H%M%S')
@@ -90,6 +91,8 @@ class CommandListener(ConnectionListener):
         self.outbox = MessageBox(os.path.join(self.broker.message_store_dir, 'outbox'))
         self.executor = ThreadPoolExecutor(thread_name_prefix='CommandListener')
         self.public_uri_template = self.broker.public_uri_template
+        self.export_delay = self.broker.export_delay
+        self.export_cache = self.broker.export_cache
 
     def on_connected(self, headers, body):
         # first attempt to send anything in the outbox
@@ -156,6 +159,8 @@ class Broker:
         self.destinations = config['DESTINATIONS']
         self.message_store_dir = config['MESSAGE_STORE_DIR']
         self.public_uri_template = config.get('PUBLIC_URI_TEMPLATE', os.environ.get('PUBLIC_URI_TEMPLATE', None))
+        self.export_delay = float(config.get('EXPORT_DELAY', 0))
+        self.export_cache = ExportCache(config['EXPORT_CACHE']) if 'EXPORT_CACHE' in config else None
         
     def connect(self):
         while not self.connection.is_connected():
@@ -15,6 +15,10 @@ from plastron.models.newspaper import Article, Issue, IssueMetadata, MetadataFil
 # alias the rdflib Namespace
 ns = ndnp
 
+# the objects created by BatchItem.read_data() can be pickled, so the loader
+# can read items ahead in separate processes
+PICKLABLE_ITEMS = True
+
 # ============================================================================
 # METADATA MAPPING
 # ============================================================================
@@ -50,6 +54,12 @@ xmlns = {
     'xlink': 'http://www.w3.org/1999/xlink',
 }
 
+METS_DMDSEC = f"{{{xmlns['METS']}}}dmdSec"
+METS_FILE = f"{{{xmlns['METS']}}}file"
+METS_TECHMD = f"{{{xmlns['METS']}}}techMD"
+# METS elements that METSResource can look up by ID
+METS_INDEXED_ELEMENTS = (METS_DMDSEC, METS_FILE, METS_TECHMD)
+
 
 # ============================================================================
 # NDNP BATCH CLASS
@@ -62,7 +72,11 @@ class Batch:
         )
         graph = repo.get_graph(config.collection_uri, include_server_managed=False)
         self.collection = pcdm.Collection.from_graph(graph, config.collection_uri)
+        # mark as created and updated, as from_repository would, so that loading
+        # items never modifies the collection; with the process pool, each item
+        # carries its own pickled copy of it, and would otherwise update it again
         self.collection.created = True
+        self.collection.updated = True
 
         self.fieldnames = ['aggregation', 'sequence', 'uri']
 
@@ -274,7 +288,7 @@ class BatchItem:
             localpath = os.path.join(self.dir, os.path.basename(href))
             basename = os.path.basename(localpath)
             mimetype = techmd['PREMIS'].find('.//premis:formatName', xmlns).text
-            source = LocalFile(localpath, mimetype=mimetype)
+            source = LocalFile(localpath, mimetype=mimetype, digest=premis_digest(techmd['PREMIS']))
 
             file_class = FILE_CLASS_FOR[use]
 
@@ -320,26 +334,43 @@ class BatchItem:
         self.logger.info('Completed post-creation actions')
 
 
+def premis_digest(techmd):
+    """The SHA-1 message digest recorded in a PREMIS technical metadata section, in "sha1=<hex>" form, or None"""
+    for fixity in techmd.findall('.//premis:fixity', xmlns):
+        algorithm = fixity.find('premis:messageDigestAlgorithm', xmlns)
+        digest = fixity.find('premis:messageDigest', xmlns)
+        if algorithm is None or digest is None:
+            continue
+        if algorithm.text.strip().upper().replace('-', '') == 'SHA1':
+            return 'sha1=' + digest.text.strip().lower()
+    return None
+
+
 class METSResource(object):
     def __init__(self, xmldoc):
         self.root = xmldoc.getroot()
         self.xpath = lxml.etree.XPathElementEvaluator(self.root, namespaces=xmlns,
                                                       smart_strings=False)
+        # index the elements that are looked up by ID, in a single pass over the document
+        self.elements_by_id = {tag: {} for tag in METS_INDEXED_ELEMENTS}
+        for element in self.root.iter(*METS_INDEXED_ELEMENTS):
+            id = element.get('ID')
+            if id is not None:
+                # keep the first element with a given ID, as the XPath lookups did
+                self.elements_by_id[element.tag].setdefault(id, element)
+
+    def find_by_id(self, tag, id):
+        try:
+            return self.elements_by_id[tag][id]
+        except KeyError:
+            name = tag.replace('{' + xmlns['METS'] + '}', 'METS:')
+            raise DataReadException(f'Cannot find {name} element with ID "{id}"')
 
     def dmdsec(self, id):
-        try:
-            return self.xpath('METS:dmdSec[@ID=$id]', id=id)[0]
-        except IndexError:
-            raise DataReadException(f'Cannot find METS:dmdSec element with ID "{id}"')
+        return self.find_by_id(METS_DMDSEC, id)
 
     def file(self, id):
-        try:
-            return self.xpath('METS:fileSec//METS:file[@ID=$id]', id=id)[0]
-        except IndexError:
-            raise DataReadException(f'Cannot find METS:file element with ID "{id}"')
+        return self.find_by_id(METS_FILE, id)
 
     def techmd(self, id):
-        try:
-            return self.xpath('METS:amdSec/METS:techMD[@ID=$id]', id=id)[0]
-        except IndexError:
-            raise DataReadException(f'Cannot find METS:techMD element with ID "{id}"')
+        return self.find_by_id(METS_TECHMD, id)
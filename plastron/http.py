@@ -1,14 +1,34 @@
+import hashlib
+import json
 import os
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from copy import copy
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 import requests
 import logging
 import threading
+from uuid import uuid4
+from requests.adapters import HTTPAdapter
 from rdflib import Graph, URIRef
+from plastron import ntriples
 from plastron.exceptions import RESTAPIException
 
 OMIT_SERVER_MANAGED_TRIPLES = 'return=representation; omit="http://fedora.info/definitions/v4/repository#ServerManaged"'
 
+# default number of simultaneous requests used by the bulk read methods
+DEFAULT_CONCURRENCY = 8
+
+# default maximum number of triples held in the in-memory graph cache
+DEFAULT_CACHE_SIZE = 100000
+
+# size of the chunks read from the response when streaming N-Triples
+NTRIPLES_CHUNK_SIZE = 65536
+
+# HTTP methods that modify the target resource, and therefore
+# invalidate any cached copy of its description
+MODIFYING_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
 
 # lightweight representation of a resource URI and URI of its description
 # for RDFSources, in general the uri and description_uri will be the same
@@ -30,11 +50,32 @@ class Repository:
         self.session = requests.Session()
         self.transaction = None
         self.load_binaries = True
+        # util.ExternalContent mapping for binaries to create as references instead of uploading
+        self.external_content = None
+        # create placeholders for binaries now and upload their content in a later pass
+        self.defer_binaries = False
+        # send the RDF description of new resources in the request that creates them
+        self.create_with_rdf = False
+        # assign URIs to new resources on the client instead of letting the server do it
+        self.mint_uris = bool(config.get('MINT_URIS', False))
         self.log_dir = config['LOG_DIR']
         self.logger = logging.getLogger(
             __name__ + '.' + self.__class__.__name__
         )
         self.ua_string = ua_string
+        self.concurrency = int(config.get('CONCURRENCY', DEFAULT_CONCURRENCY))
+
+        # make sure the connection pool is large enough that concurrent
+        # requests don't end up discarding connections
+        adapter = HTTPAdapter(pool_maxsize=max(self.concurrency, requests.adapters.DEFAULT_POOLSIZE))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        cache_size = int(config.get('CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        if cache_size > 0:
+            self.cache = GraphCache(max_triples=cache_size, directory=config.get('CACHE_DIR', None))
+        else:
+            self.cache = None
 
         if 'CLIENT_CERT' in config and 'CLIENT_KEY' in config:
             self.session.cert = (config['CLIENT_CERT'], config['CLIENT_KEY'])
@@ -44,6 +85,17 @@ class Repository:
         if 'SERVER_CERT' in config:
             self.session.verify = config['SERVER_CERT']
 
+    def clone(self):
+        """
+        Returns a copy of this repository that shares its HTTP session and graph
+        cache, but that has its own current path and transaction. Used to run
+        several transactions at the same time from different threads.
+        """
+        repository = copy(self)
+        repository._path_stack = list(self._path_stack)
+        repository.transaction = None
+        return repository
+
     def at_path(self, relpath):
         self._path_stack.append(self.relpath)
         self.relpath = relpath
@@ -78,6 +130,8 @@ class Repository:
             if 'headers' not in kwargs:
                 kwargs['headers'] = {}
             kwargs['headers']['User-Agent'] = self.ua_string
+        if self.cache is not None and method in MODIFYING_METHODS:
+            self.cache.invalidate(self._remove_transaction_uri(url), descendants=(method == 'DELETE'))
         response = self.session.request(method, target_uri, **kwargs)
         self.logger.debug("%s %s", response.status_code, response.reason)
         return response
@@ -116,38 +170,157 @@ class Repository:
         else:
             raise RESTAPIException(response)
 
-    def recursive_get(self, url, traverse=None, **kwargs):
+    # returns the URI of the RDF description of a resource; for binaries this is
+    # the target of the "describedby" link, for RDF sources it is the URI itself
+    def get_description_uri(self, url, **kwargs):
         head_response = self.head(url, **kwargs)
         if 'describedby' in head_response.links:
-            target = head_response.links['describedby']['url']
+            return head_response.links['describedby']['url']
         else:
-            target = url
+            return url
 
-        graph = self.get_graph(target)
+    def get_resource(self, url, include_server_managed=True, lightweight=False, **kwargs):
+        target = self.get_description_uri(url, **kwargs)
+        graph = self.get_graph(target, include_server_managed=include_server_managed, lightweight=lightweight)
         resource = Resource(
             uri=self._remove_transaction_uri(url),
             description_uri=self._remove_transaction_uri(target)
         )
-        yield (resource, graph)
-        if traverse is not None:
-            for (s, p, o) in graph:
-                if p in traverse:
-                    for (resource, graph) in self.recursive_get(str(o), traverse=traverse, **kwargs):
-                        yield (resource, graph)
-
-    def get_graph(self, url, include_server_managed=True):
+        return resource, graph
+
+    def recursive_get(self, url, traverse=None, **kwargs):
+        return self.walk([url], traverse=traverse, **kwargs)
+
+    def walk(self, uris, traverse=None, max_depth=None, concurrency=None, on_error=None, **kwargs):
+        """
+        Breadth-first traversal starting from the given URIs and following
+        the objects of any of the predicates in traverse. Each level of the
+        traversal is fetched concurrently using get_graphs(), and every
+        resource is only fetched once, no matter how many times (or through
+        how many different paths) it is linked to. If max_depth is given,
+        stop after following that many links from the starting URIs.
+        """
+        visited = set()
+
+        def unvisited(candidates):
+            for uri in candidates:
+                key = self._remove_transaction_uri(str(uri))
+                if key not in visited:
+                    visited.add(key)
+                    yield str(uri)
+
+        frontier = unvisited(uris)
+        depth = 0
+        while frontier:
+            next_level = []
+            for resource, graph in self.get_graphs(frontier, concurrency=concurrency, ordered=True,
+                                                   on_error=on_error, **kwargs):
+                yield resource, graph
+                if traverse is not None and (max_depth is None or depth < max_depth):
+                    next_level.extend(o for (s, p, o) in graph if p in traverse)
+            frontier = list(unvisited(next_level))
+            depth += 1
+
+    def get_graphs(self, uris, concurrency=None, ordered=False, on_error=None, **kwargs):
+        """
+        Fetch the RDF descriptions of the given URIs using a pool of worker
+        threads, yielding (Resource, Graph) tuples as each one completes. If
+        ordered is true, results are yielded in the same order as the input.
+
+        A URI that cannot be retrieved does not stop the rest of the batch;
+        instead, on_error is called with the URI and the exception. The
+        default is to log the error and continue.
+        """
+        if concurrency is None:
+            concurrency = self.concurrency
+        if on_error is None:
+            on_error = self._log_fetch_error
+
+        # keep enough requests queued up that the workers never sit idle,
+        # without reading the whole (possibly very long) list of URIs at once
+        window = concurrency * 2
+        uri_iter = iter(uris)
+        # URIs by future, in the order they were submitted
+        pending = {}
+
+        def submit_next():
+            for uri in uri_iter:
+                pending[executor.submit(self.get_resource, uri, **kwargs)] = uri
+                return True
+            return False
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='get_graphs') as executor:
+            while len(pending) < window and submit_next():
+                pass
+
+            while pending:
+                if ordered:
+                    done = [next(iter(pending))]
+                    wait(done)
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    uri = pending.pop(future)
+                    submit_next()
+                    # anything that goes wrong with one URI, including a response
+                    # that can't be parsed, is reported without ending the batch
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        on_error(uri, e)
+                    else:
+                        yield result
+
+    def _log_fetch_error(self, uri, exception):
+        self.logger.error(f'Unable to retrieve {uri}: {exception}')
+
+    # if lightweight is true, the N-Triples response is decoded into a
+    # plastron.ntriples.TripleIndex instead of a full rdflib Graph; this is
+    # much faster, and is suitable for any caller that only reads the graph.
+    # when caching is enabled, the graph returned may be shared with other
+    # callers, so use copy_graph() on it before making any changes
+    def get_graph(self, url, include_server_managed=True, lightweight=False):
+        # the cache is shared with clones of this repository, so it must only
+        # hold descriptions as seen outside of any transaction
+        if self.cache is None or self.in_transaction():
+            return self._get_graph(url, include_server_managed, lightweight).graph
+
+        key = (self._remove_transaction_uri(str(url)), include_server_managed, lightweight)
+        return self.cache.get(key, lambda cached: self._get_graph(url, include_server_managed, lightweight, cached))
+
+    # if a cached entry is given, make a conditional request and return that
+    # same entry if the server reports the resource has not been modified
+    def _get_graph(self, url, include_server_managed=True, lightweight=False, cached=None):
         headers = {
             'Accept': 'application/n-triples'
         }
         if not include_server_managed:
             headers['Prefer'] = OMIT_SERVER_MANAGED_TRIPLES
-        response = self.get(url, headers=headers, stream=True)
-        if response.status_code != 200:
-            self.logger.error(f"Unable to get {headers['Accept']} representation of {url}")
-            raise RESTAPIException(response)
-        graph = Graph()
-        graph.parse(data=response.text, format='nt')
-        return graph
+        if cached is not None:
+            if cached.etag is not None:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified is not None:
+                headers['If-Modified-Since'] = cached.last_modified
+        # close the streamed response on every path, so its connection goes back to the pool
+        with self.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and cached is not None:
+                return cached
+            if response.status_code != 200:
+                self.logger.error(f"Unable to get {headers['Accept']} representation of {url}")
+                # read the (small) error body now, so it is still available once the response is closed
+                response.content
+                raise RESTAPIException(response)
+            if lightweight:
+                graph = ntriples.parse(response.iter_lines(chunk_size=NTRIPLES_CHUNK_SIZE))
+            else:
+                graph = Graph()
+                graph.parse(data=response.text, format='nt')
+            return CacheEntry(
+                graph=graph,
+                etag=response.headers.get('ETag', None),
+                last_modified=response.headers.get('Last-Modified', None)
+            )
 
     def get_transaction_endpoint(self):
         return os.path.join(self.endpoint, 'fcr:tx')
@@ -177,6 +350,188 @@ class Repository:
     def uri(self):
         return '/'.join([p.strip('/') for p in (self.endpoint, self.relpath)])
 
+    # a new, unused URI under the current path, using the same pairtree layout
+    # that Fedora uses for the URIs it assigns
+    def mint_uri(self):
+        return URIRef('/'.join([self.uri(), pairtree_path(str(uuid4()))]))
+
+
+def pairtree_path(identifier, levels=4, width=2):
+    # e.g., "3b6e5f0c-..." becomes "3b/6e/5f/0c/3b6e5f0c-..."
+    segments = [identifier[i * width:(i + 1) * width] for i in range(levels)]
+    return '/'.join(segments + [identifier])
+
+
+CacheEntry = namedtuple('CacheEntry', ['graph', 'etag', 'last_modified'])
+
+
+class GraphCache:
+    """
+    Cache of resource descriptions, bounded by the total number of triples
+    held in memory, with an optional (unbounded) on-disk tier. Entries are
+    always revalidated with a conditional request before they are used, so
+    the cache saves transfer and parsing time, not round trips.
+
+    Concurrent requests for the same key are collapsed into a single call.
+    """
+    def __init__(self, max_triples=DEFAULT_CACHE_SIZE, directory=None):
+        self.max_triples = max_triples
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.size = 0
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.invalidations = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'collapsed': self.collapsed,
+            'invalidations': self.invalidations,
+            'entries': len(self.entries),
+            'triples': self.size
+        }
+
+    def get(self, key, fetch):
+        """
+        Return the graph for the given key. The fetch function is called
+        with the cached entry (or None) and must return a CacheEntry;
+        returning the same entry it was passed signals a cache hit. The graph
+        is the instance held by the cache, shared with every other caller,
+        so it must not be modified (see copy_graph).
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.collapsed += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            cached = self._lookup(key)
+            entry = fetch(cached)
+            with self.lock:
+                if cached is not None and entry is cached:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            self._store(key, entry, write_through=(entry is not cached))
+            future.set_result(entry.graph)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+        return entry.graph
+
+    def invalidate(self, uri, descendants=False):
+        prefix = uri.rstrip('/') + '/'
+        with self.lock:
+            keys = [key for key in self.entries
+                    if key[0] == uri or key[0] == prefix + 'fcr:metadata' or
+                    (descendants and key[0].startswith(prefix))]
+            for key in keys:
+                self.size -= len(self.entries.pop(key).graph)
+            self.invalidations += len(keys)
+        if self.directory is not None:
+            for include_server_managed in (True, False):
+                for lightweight in (True, False):
+                    for target in (uri, prefix + 'fcr:metadata'):
+                        self._remove_file((target, include_server_managed, lightweight))
+
+    def _lookup(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.directory is not None:
+            return self._read_file(key)
+        return None
+
+    def _store(self, key, entry, write_through=True):
+        if entry.etag is None and entry.last_modified is None:
+            # nothing to revalidate against, so there is no point in keeping it
+            return
+        size = len(entry.graph)
+        if size <= self.max_triples:
+            with self.lock:
+                if key in self.entries:
+                    self.size -= len(self.entries.pop(key).graph)
+                self.entries[key] = entry
+                self.size += size
+                # evict least-recently used entries until we are back under the limit
+                while self.size > self.max_triples:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted.graph)
+        if write_through and self.directory is not None:
+            self._write_file(key, entry)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+    def _read_file(self, key):
+        filename = self._filename(key)
+        try:
+            with open(filename + '.json', 'r') as fh:
+                metadata = json.load(fh)
+            if key[2]:
+                with open(filename + '.nt', 'rb') as fh:
+                    graph = ntriples.parse(fh)
+            else:
+                graph = Graph()
+                graph.parse(source=filename + '.nt', format='nt')
+        except (OSError, ValueError) as e:
+            self.logger.debug(f'No usable cache file for {key[0]}: {e}')
+            return None
+        return CacheEntry(graph=graph, etag=metadata['etag'], last_modified=metadata['last_modified'])
+
+    def _write_file(self, key, entry):
+        filename = self._filename(key)
+        try:
+            with open(filename + '.nt', 'wb') as fh:
+                entry.graph.serialize(destination=fh, format='nt', encoding='utf-8')
+            # write the metadata last, and atomically, since it is what marks the entry as usable
+            with open(filename + '.json.tmp', 'w') as fh:
+                json.dump({'uri': key[0], 'etag': entry.etag, 'last_modified': entry.last_modified}, fh)
+            os.replace(filename + '.json.tmp', filename + '.json')
+        except OSError as e:
+            self.logger.warning(f'Unable to write cache file for {key[0]}: {e}')
+
+    def _remove_file(self, key):
+        filename = self._filename(key)
+        for extension in ('.json', '.nt'):
+            try:
+                os.remove(filename + extension)
+            except FileNotFoundError:
+                pass
+
+
+def copy_graph(graph):
+    # graphs from the cache are shared, so a caller that needs to modify one
+    # must work on a copy; copying a full rdflib Graph costs about half as
+    # much as parsing it again, so it is not done for the callers that only read
+    if isinstance(graph, ntriples.TripleIndex):
+        return graph.copy()
+    graph_copy = Graph()
+    graph_copy += graph
+    return graph_copy
+
 
 class Transaction:
     def __init__(self, repository, keep_alive=90):
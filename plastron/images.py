@@ -0,0 +1,119 @@
+"""Find the pixel dimensions of an image from its bytes as they stream past,
+without needing to seek in or re-read the file. Supports PNG, GIF, JPEG, and
+TIFF (including TIFFs whose image file directory comes after the image data)."""
+
+import struct
+
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers that are not followed by a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+JPEG_SOS = 0xDA
+
+TIFF_IMAGE_WIDTH = 256
+TIFF_IMAGE_LENGTH = 257
+TIFF_SHORT = 3
+TIFF_LONG = 4
+
+
+class ImageDimensions:
+    """
+    Receives the bytes of an image in order through update() (so it can be used
+    alongside hashlib objects on a stream) and sets width and height as soon as
+    it has seen enough of the image to know them. Only the byte ranges that the
+    format parser asks for are kept in memory.
+    """
+    def __init__(self):
+        self.width = None
+        self.height = None
+        self.format = None
+        self.done = False
+        # absolute offset of the first byte in the buffer
+        self.position = 0
+        self.buffer = bytearray()
+        self.parser = self._parse()
+        self.request = next(self.parser)
+
+    def update(self, data):
+        if self.done:
+            return
+        self.buffer.extend(data)
+        while not self.done:
+            offset, length = self.request
+            if offset < self.position:
+                # the parser wants bytes that have already gone past
+                self._finish()
+                return
+            end = self.position + len(self.buffer)
+            if offset + length > end:
+                # drop everything before the requested range while we wait for it
+                if offset > self.position:
+                    del self.buffer[:min(offset, end) - self.position]
+                    self.position = min(offset, end)
+                return
+            start = offset - self.position
+            chunk = bytes(self.buffer[start:start + length])
+            try:
+                self.request = self.parser.send(chunk)
+            except StopIteration:
+                self._finish()
+
+    def _finish(self):
+        self.done = True
+        self.buffer = bytearray()
+
+    def _parse(self):
+        # each yield is a request for the (offset, length) bytes of the image
+        signature = yield 0, 4
+        if signature == b'\x89PNG':
+            self.format = 'PNG'
+            self.width, self.height = struct.unpack('>II', (yield 16, 8))
+        elif signature[:3] == b'GIF':
+            self.format = 'GIF'
+            self.width, self.height = struct.unpack('<HH', (yield 6, 4))
+        elif signature[:2] == b'\xff\xd8':
+            self.format = 'JPEG'
+            yield from self._parse_jpeg()
+        elif signature in (b'II*\x00', b'MM\x00*'):
+            self.format = 'TIFF'
+            yield from self._parse_tiff('<' if signature[:2] == b'II' else '>')
+
+    def _parse_jpeg(self):
+        offset = 2
+        while True:
+            fill, marker = (yield offset, 2)
+            if fill != 0xFF:
+                return
+            if marker == 0xFF:
+                # padding between markers
+                offset += 1
+                continue
+            if marker in JPEG_STANDALONE_MARKERS:
+                offset += 2
+                continue
+            if marker in JPEG_SOF_MARKERS:
+                # segment length (2), sample precision (1), then height and width
+                self.height, self.width = struct.unpack('>HH', (yield offset + 5, 4))
+                return
+            if marker == JPEG_SOS:
+                # entropy-coded data starts here without a frame header
+                return
+            (length,) = struct.unpack('>H', (yield offset + 2, 2))
+            offset += 2 + length
+
+    def _parse_tiff(self, byte_order):
+        (ifd_offset,) = struct.unpack(byte_order + 'I', (yield 4, 4))
+        (count,) = struct.unpack(byte_order + 'H', (yield ifd_offset, 2))
+        entries = yield ifd_offset + 2, 12 * count
+        for i in range(count):
+            entry = entries[12 * i:12 * (i + 1)]
+            tag, field_type = struct.unpack(byte_order + 'HH', entry[:4])
+            if field_type == TIFF_SHORT:
+                (value,) = struct.unpack(byte_order + 'H', entry[8:10])
+            elif field_type == TIFF_LONG:
+                (value,) = struct.unpack(byte_order + 'I', entry[8:12])
+            else:
+                continue
+            if tag == TIFF_IMAGE_WIDTH:
+                self.width = value
+            elif tag == TIFF_IMAGE_LENGTH:
+                self.height = value
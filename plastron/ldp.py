@@ -1,8 +1,9 @@
 """On LDP, see http://www.w3.org/TR/2015/REC-ldp-20150226"""
 
 import logging
+from itertools import chain
 from uuid import uuid4
-from rdflib import Graph, URIRef
+from rdflib import Graph, RDF, URIRef
 from datetime import datetime as dt
 from plastron import rdf
 from plastron.exceptions import RESTAPIException
@@ -34,6 +35,11 @@ class Resource(rdf.Resource):
         self.updated = False
         self.uuid = None
         self.creation_timestamp = None
+        # links to resources that did not exist yet when this resource was
+        # created with an RDF body; None means it was created empty
+        self.pending_links = None
+        # true if the URI was minted by the client rather than assigned by the server
+        self.minted = False
         self.logger = logging.getLogger(
             __name__ + '.' + self.__class__.__name__
         )
@@ -52,26 +58,71 @@ class Resource(rdf.Resource):
             self.created = True
             return False
 
+        if uri is None and self.minted:
+            uri = self.uri
+
         self.logger.info(f"Creating {self}...")
         try:
-            self.uri = repository.create(url=uri)
+            if repository.create_with_rdf:
+                # assign relative hash URIs now, so the embedded objects can
+                # be sent along with the rest of the description
+                self.create_fragments(base='')
+                graph, self.pending_links = self.creation_graph(repository)
+                headers = {'Content-Type': 'text/turtle'}
+                data = serialize_relative(graph, base=self.uri).encode('utf-8')
+                self.uri = repository.create(url=uri, data=data, headers=headers)
+                self.rebase_fragments()
+            else:
+                self.uri = repository.create(url=uri)
+                self.create_fragments()
             self.created = True
             self.logger.info(f"Created {self}")
             self.uuid = str(self.uri).rsplit('/', 1)[-1]
             self.logger.info(
                 'URI: {0} / UUID: {1}'.format(self.uri, self.uuid)
             )
-            self.create_fragments()
         except RESTAPIException as e:
             self.logger.error(f"Failed to create {self}")
             raise e
 
-    def create_fragments(self):
+    def create_fragments(self, base=None):
+        if base is None:
+            base = self.uri
         for obj in self.embedded_objects():
             obj.uuid = uuid4()
-            obj.uri = URIRef('{0}#{1}'.format(self.uri, obj.uuid))
+            obj.uri = URIRef('{0}#{1}'.format(base, obj.uuid))
             obj.created = True
 
+    # re-root the hash URIs of the embedded objects on this object's current URI
+    def rebase_fragments(self):
+        for obj in self.embedded_objects():
+            obj.uri = URIRef('{0}#{1}'.format(self.uri, obj.uuid))
+
+    def creation_graph(self, repository):
+        """
+        Returns a graph of this resource and its embedded objects that can be
+        sent in the request that creates it, and a list of (resource, property,
+        value) links that have to wait for an update because their target does
+        not exist in the repository yet.
+        """
+        graph = Graph()
+        pending_links = []
+        for resource in chain([self], self.embedded_objects()):
+            subject = URIRef(resource.uri)
+            for rdf_type in resource.rdf_types:
+                graph.add((subject, RDF.type, rdf_type))
+            for prop in resource.properties():
+                for value in prop.values:
+                    if value is None:
+                        continue
+                    if is_pending(value, repository):
+                        pending_links.append((resource, prop, value))
+                    else:
+                        graph.add((subject, prop.uri, prop.get_term(value)))
+            for (s, p, o) in resource.unmapped_triples:
+                graph.add((subject, p, o))
+        return graph, pending_links
+
     def patch(self, repository, sparql_update):
         headers = {'Content-Type': 'application/sparql-update'}
         self.logger.info(f"Updating {self}")
@@ -87,7 +138,17 @@ class Resource(rdf.Resource):
 
     # update existing repo object with SPARQL update
     def update_object(self, repository, patch_uri=None):
-        graph = self.graph()
+        if self.pending_links is not None:
+            # this resource was created with its description, so the only
+            # thing left to add is the links that were not resolvable then
+            graph = Graph()
+            for resource, prop, value in self.pending_links:
+                graph.add((URIRef(resource.uri), prop.uri, prop.get_term(value)))
+            if len(graph) == 0:
+                self.updated = True
+                return
+        else:
+            graph = self.graph()
         if not patch_uri:
             patch_uri = self.uri
         prolog = ''
@@ -136,6 +197,21 @@ class Resource(rdf.Resource):
             else:
                 obj.recursive_create(repository)
 
+    # recursively assign client-minted URIs to an object and the components
+    # and annotations that don't yet exist, before creating any of them
+    def recursive_mint(self, repository):
+        if self.created or self.minted or str(self.uri).startswith(repository.endpoint):
+            return
+        self.uri = repository.mint_uri()
+        self.minted = True
+
+        for obj in self.linked_objects():
+            if isinstance(obj, Resource):
+                obj.recursive_mint(repository)
+        with repository.at_path('annotations'):
+            for annotation in self.annotations:
+                annotation.recursive_mint(repository)
+
     # recursively update an object and all its components and files
     def recursive_update(self, repository):
         if not self.updated:
@@ -145,7 +221,10 @@ class Resource(rdf.Resource):
 
     # check for the existence of a local object in the repository
     def exists_in_repo(self, repository):
-        if str(self.uri).startswith(repository.endpoint):
+        if self.minted:
+            # freshly minted URIs can't exist yet, so don't bother asking
+            return False
+        elif str(self.uri).startswith(repository.endpoint):
             response = repository.head(str(self.uri))
             if response.status_code == 200:
                 return True
@@ -178,6 +257,43 @@ class Resource(rdf.Resource):
             annotation.recursive_update(repository)
 
 
+def is_pending(value, repository):
+    """
+    True if the value is an object that has not been created yet and does
+    not have a repository URI, so it cannot be linked to until it is created.
+    """
+    return (
+        hasattr(value, 'uri') and
+        not getattr(value, 'created', True) and
+        not str(value.uri).startswith(repository.endpoint)
+    )
+
+
+def serialize_relative(graph, base):
+    """
+    Serialize a graph as Turtle for use as the body of a creation request,
+    with the base URI and any hash URIs written as relative URI references
+    (<> and <#fragment>) so they are resolved against the new resource.
+    """
+    nsm = graph.namespace_manager
+
+    def n3(term):
+        if isinstance(term, URIRef):
+            if term == base:
+                return '<>'
+            elif '#' in term and term[:term.index('#')] in ('', base):
+                return '<' + term[term.index('#'):] + '>'
+        return term.n3(nsm)
+
+    statements = []
+    for (s, p, o) in graph:
+        statements.append(f'{n3(s)} {nsm.normalizeUri(p)} {n3(o)} .')
+
+    # build the prolog last, since normalizing the predicates may have bound new prefixes
+    prolog = [f'@prefix {prefix}: {uri.n3()} .' for (prefix, uri) in nsm.namespaces()]
+    return '\n'.join(prolog + statements) + '\n'
+
+
 class RdfSource(Resource):
     """Class representing a Linked Data Platform RDF Source (LDP-RS)
     An LDPR whose state is fully represented in RDF, corresponding to an RDF
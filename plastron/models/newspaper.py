@@ -1,4 +1,4 @@
-from lxml.etree import parse, XMLSyntaxError
+from lxml.etree import XMLSyntaxError
 from rdflib import URIRef
 from plastron import pcdm, ocr, oa, rdf
 from plastron.exceptions import DataReadException
@@ -29,11 +29,11 @@ class TextblockOnPage(oa.Annotation):
         super().__init__()
         self.add_body(
             oa.TextualBody(
-                value=textblock.text(scale=page.ocr.scale),
+                value=textblock.text(),
                 content_type='text/plain'
             )
         )
-        xywh = ','.join([str(i) for i in textblock.xywh(page.ocr.scale)])
+        xywh = ','.join([str(i) for i in textblock.xywh])
         self.add_target(
             oa.SpecificResource(
                 source=page,
@@ -77,14 +77,31 @@ class Page(pcdm.Object):
     """Newspaper page"""
 
     @classmethod
-    def from_repository(cls, repo, page_uri):
-        page = cls.from_graph(repo.get_graph(page_uri))
+    def from_repository(cls, repo, page_uri, uses=None):
+        """
+        Load a page and its files from the repository. If uses is given, only
+        the files with those uses (e.g., 'ocr' and 'master') are loaded, and
+        the descriptions of files whose content type rules them out are not
+        fetched at all.
+        """
+        page = cls.from_graph(repo.get_graph(page_uri), subject=page_uri)
         page.uri = page_uri
         page.created = True
         page.updated = True
 
         # map file URIs to File objects
-        page.files = list(map(lambda f: File.from_repository(repo, f), page.files))
+        if uses is None:
+            page.files = list(map(lambda f: File.from_repository(repo, f), page.files))
+        else:
+            files = []
+            for file_uri in page.files:
+                head_response = repo.head(file_uri)
+                if not could_have_use(head_response.headers.get('Content-Type'), uses):
+                    continue
+                file = File.from_repository(repo, file_uri, head_response=head_response)
+                if getattr(file, 'use', None) in uses:
+                    files.append(file)
+            page.files = files
 
         page.parse_ocr()
 
@@ -93,8 +110,8 @@ class Page(pcdm.Object):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.ordered = True
-        self.ocr = None
         self.ocr_file = None
+        self.ocr_resolution = None
 
     def parse_ocr(self):
         # try to get an OCR file
@@ -104,26 +121,26 @@ class Page(pcdm.Object):
         except StopIteration:
             return
 
-        # load ALTO XML into page object, for text extraction
-        try:
-            with ocr_file.source.data() as stream:
-                tree = parse(stream)
-        except OSError:
-            raise DataReadException("Unable to read {0}".format(ocr_file.filename))
-        except XMLSyntaxError:
-            raise DataReadException("Unable to parse {0} as XML".format(ocr_file.filename))
+        # the ALTO XML is not read until its text blocks are needed, and then
+        # it is streamed, so the page never holds on to the whole document
 
         # read in resolution from issue METS data
         master = next(self.files_for('master'))
         self.ocr_file = ocr_file
-        self.ocr = ocr.ALTOResource(tree, master.resolution)
+        self.ocr_resolution = master.resolution
 
     def textblocks(self):
-        if self.ocr is None:
-            raise StopIteration()
+        if self.ocr_file is None:
+            return
         # extract text blocks from ALTO XML for this page
-        for textblock in self.ocr.textblocks():
-            yield TextblockOnPage(textblock, self)
+        try:
+            with self.ocr_file.source.data() as stream:
+                for textblock in ocr.iter_textblocks(stream, self.ocr_resolution):
+                    yield TextblockOnPage(textblock, self)
+        except OSError:
+            raise DataReadException("Unable to read {0}".format(self.ocr_file.filename))
+        except XMLSyntaxError:
+            raise DataReadException("Unable to parse {0} as XML".format(self.ocr_file.filename))
 
     def files_for(self, use):
         for f in self.files:
@@ -131,12 +148,32 @@ class Page(pcdm.Object):
                 yield f
 
 
+# content types (or content type prefixes) that the newspaper files for each use can have
+CONTENT_TYPES_FOR_USE = {
+    'master': ('image/',),
+    'ocr': ('text/xml', 'application/xml'),
+}
+
+
+def could_have_use(content_type, uses):
+    """
+    False if a file with the given content type cannot be a file for any of
+    the given uses. Files with no content type, or a generic one, might be.
+    """
+    if content_type is None:
+        return True
+    content_type = content_type.split(';')[0].strip()
+    if content_type in ('', 'application/octet-stream'):
+        return True
+    return any(content_type.startswith(prefix) for use in uses for prefix in CONTENT_TYPES_FOR_USE.get(use, ('',)))
+
+
 class File(pcdm.File):
     """Newspaper file"""
 
     @classmethod
-    def from_repository(cls, repo, file_uri):
-        source = RepositoryFile(repo, file_uri)
+    def from_repository(cls, repo, file_uri, head_response=None):
+        source = RepositoryFile(repo, file_uri, head_response=head_response)
         file_graph = source.file_graph
         title = file_graph.value(subject=file_uri, predicate=dcterms.title)
         file = cls(source, title=title)
@@ -0,0 +1,236 @@
+"""Fast, line-oriented N-Triples decoding that bypasses rdflib's parser and store.
+
+See https://www.w3.org/TR/n-triples/"""
+
+import re
+from rdflib import BNode, Graph, Literal, URIRef, RDF
+from rdflib.exceptions import UniquenessError
+
+IRI = r'<([^>]*)>'
+BNODE_LABEL = r'_:([A-Za-z0-9_](?:[A-Za-z0-9_.\-]*[A-Za-z0-9_\-])?)'
+LITERAL = r'"((?:[^"\\]|\\.)*)"(?:@([a-zA-Z]+(?:-[a-zA-Z0-9]+)*)|\^\^<([^>]*)>)?'
+
+TRIPLE = re.compile(
+    rf'^\s*(?:{IRI}|{BNODE_LABEL})\s*{IRI}\s*(?:{IRI}|{BNODE_LABEL}|{LITERAL})\s*\.\s*(?:#.*)?$'
+)
+BLANK_OR_COMMENT = re.compile(r'^\s*(?:#.*)?$')
+
+ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ECHARS = {
+    't': '\t',
+    'b': '\b',
+    'n': '\n',
+    'r': '\r',
+    'f': '\f',
+    '"': '"',
+    "'": "'",
+    '\\': '\\'
+}
+
+
+def _replace_escape(match):
+    short, long, echar = match.groups()
+    if echar is not None:
+        try:
+            return ECHARS[echar]
+        except KeyError:
+            raise ValueError(f'Invalid escape sequence \\{echar}')
+    return chr(int(short or long, 16))
+
+
+def unescape(string):
+    if '\\' not in string:
+        return string
+    return ESCAPE.sub(_replace_escape, string)
+
+
+class Decoder:
+    """
+    Decodes N-Triples lines into rdflib terms. Terms are interned, so every
+    occurrence of the same IRI, blank node, or literal in the input is
+    represented by the same Python object.
+    """
+    def __init__(self):
+        self.terms = {}
+
+    def iri(self, value):
+        key = ('<', value)
+        try:
+            return self.terms[key]
+        except KeyError:
+            term = self.terms[key] = URIRef(unescape(value))
+            return term
+
+    def bnode(self, label):
+        key = ('_', label)
+        try:
+            return self.terms[key]
+        except KeyError:
+            term = self.terms[key] = BNode(label)
+            return term
+
+    def literal(self, lexical, language, datatype):
+        key = ('"', lexical, language, datatype)
+        try:
+            return self.terms[key]
+        except KeyError:
+            term = self.terms[key] = Literal(
+                unescape(lexical),
+                lang=language,
+                datatype=self.iri(datatype) if datatype is not None else None
+            )
+            return term
+
+    def decode(self, lines):
+        """Generator of (subject, predicate, object) tuples from an iterable of lines (str or bytes)."""
+        for line_number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            match = TRIPLE.match(line)
+            if match is None:
+                if BLANK_OR_COMMENT.match(line):
+                    continue
+                raise ValueError(f'Invalid N-Triples statement on line {line_number}: {line}')
+
+            s_iri, s_bnode, p_iri, o_iri, o_bnode, lexical, language, datatype = match.groups()
+            subject = self.iri(s_iri) if s_iri is not None else self.bnode(s_bnode)
+            predicate = self.iri(p_iri)
+            if o_iri is not None:
+                obj = self.iri(o_iri)
+            elif o_bnode is not None:
+                obj = self.bnode(o_bnode)
+            else:
+                obj = self.literal(lexical, language, datatype)
+            yield subject, predicate, obj
+
+
+def encode_term(term):
+    """Serialize a single rdflib term in N-Triples syntax."""
+    if isinstance(term, Literal):
+        lexical = (str(term)
+                   .replace('\\', '\\\\')
+                   .replace('"', '\\"')
+                   .replace('\n', '\\n')
+                   .replace('\r', '\\r'))
+        if term.language:
+            return f'"{lexical}"@{term.language}'
+        elif term.datatype:
+            return f'"{lexical}"^^<{term.datatype}>'
+        else:
+            return f'"{lexical}"'
+    elif isinstance(term, BNode):
+        return f'_:{term}'
+    else:
+        return f'<{term}>'
+
+
+def encode_triple(triple):
+    s, p, o = triple
+    return f'{encode_term(s)} {encode_term(p)} {encode_term(o)} .\n'
+
+
+def encode_quad(triple, graph_name):
+    s, p, o = triple
+    return f'{encode_term(s)} {encode_term(p)} {encode_term(o)} {encode_term(graph_name)} .\n'
+
+
+def parse(lines):
+    return TripleIndex(Decoder().decode(lines))
+
+
+class TripleIndex:
+    """
+    A read-mostly set of triples indexed by subject. Implements the subset of
+    the rdflib Graph API used by plastron (triples, subjects, objects, value,
+    serialize, iteration, etc.) so it can be passed anywhere a Graph is read.
+    """
+    def __init__(self, triples=None):
+        self._index = {}
+        self._length = 0
+        if triples is not None:
+            for triple in triples:
+                self.add(triple)
+
+    def add(self, triple):
+        s, p, o = triple
+        statements = self._index.setdefault(s, {})
+        if (p, o) not in statements:
+            statements[(p, o)] = None
+            self._length += 1
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return self.triples((None, None, None))
+
+    def __contains__(self, triple):
+        s, p, o = triple
+        return (p, o) in self._index.get(s, ())
+
+    def triples(self, pattern):
+        s, p, o = pattern
+        if s is not None:
+            subjects = [s] if s in self._index else []
+        else:
+            subjects = self._index.keys()
+        for subject in subjects:
+            for predicate, obj in self._index[subject]:
+                if (p is None or p == predicate) and (o is None or o == obj):
+                    yield subject, predicate, obj
+
+    def subjects(self, predicate=None, object=None):
+        for s, p, o in self.triples((None, predicate, object)):
+            yield s
+
+    def predicates(self, subject=None, object=None):
+        for s, p, o in self.triples((subject, None, object)):
+            yield p
+
+    def objects(self, subject=None, predicate=None):
+        for s, p, o in self.triples((subject, predicate, None)):
+            yield o
+
+    def value(self, subject=None, predicate=RDF.value, object=None, default=None, any=True):
+        if subject is None:
+            values = self.subjects(predicate, object)
+        elif predicate is None:
+            values = self.predicates(subject, object)
+        else:
+            values = self.objects(subject, predicate)
+
+        values = iter(values)
+        try:
+            value = next(values)
+        except StopIteration:
+            return default
+        if not any:
+            for other in values:
+                if other != value:
+                    raise UniquenessError([value, other])
+        return value
+
+    def copy(self):
+        index_copy = TripleIndex()
+        index_copy._index = {s: dict(statements) for s, statements in self._index.items()}
+        index_copy._length = self._length
+        return index_copy
+
+    def to_graph(self):
+        graph = Graph()
+        for triple in self:
+            graph.add(triple)
+        return graph
+
+    def serialize(self, destination=None, format='turtle', encoding=None, **kwargs):
+        if format not in ('nt', 'ntriples'):
+            return self.to_graph().serialize(destination=destination, format=format, encoding=encoding, **kwargs)
+
+        data = ''.join(encode_triple(triple) for triple in self).encode('utf-8')
+        if destination is None:
+            return data
+        elif hasattr(destination, 'write'):
+            destination.write(data)
+        else:
+            with open(destination, 'wb') as fh:
+                fh.write(data)
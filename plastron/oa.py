@@ -1,6 +1,6 @@
 from rdflib import RDF
 from plastron import ldp, rdf
-from plastron.namespaces import dcterms, oa
+from plastron.namespaces import dcterms, oa, ore, sc
 
 # alias the rdflib Namespace
 ns = oa
@@ -60,3 +60,37 @@ class FragmentSelector(ldp.Resource):
 class XPathSelector(ldp.Resource):
     def __str__(self):
         return str(self.value)
+
+
+# Annotation lists
+@rdf.object_property('resources', ore.aggregates, embed=True)
+@rdf.rdf_class(sc.AnnotationList)
+class AnnotationList(ldp.Resource):
+    """A single resource that holds a set of annotations as hash URI
+    fragments, so they can be created and updated with one request each
+    instead of one resource per annotation"""
+    def __str__(self):
+        return f'Annotation list with {len(self.resources)} annotation(s)'
+
+
+def group_annotations(annotations):
+    """Combines the annotations into one AnnotationList for each resource they
+    target (e.g., a newspaper page), in the order the resources are first
+    targeted. Annotations that do not target a SpecificResource are returned
+    as they are."""
+    results = []
+    lists = {}
+    for annotation in annotations:
+        sources = [
+            target.source.values[0] for target in annotation.target
+            if isinstance(target, SpecificResource) and len(target.source) > 0
+        ]
+        if not sources:
+            results.append(annotation)
+            continue
+        key = id(sources[0])
+        if key not in lists:
+            lists[key] = AnnotationList()
+            results.append(lists[key])
+        lists[key].resources.append(annotation)
+    return results
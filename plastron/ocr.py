@@ -1,104 +1,185 @@
+import math
+from bisect import bisect_right
+
+import numpy as np
 from lxml import etree
 
+from plastron.exceptions import DataReadException
+
 ns = {
     "alto": "http://www.loc.gov/standards/alto/ns-v2#"
 }
 
 
-class ALTOResource(object):
-    def __init__(self, xmldoc, image_resolution):
-        self.xmldoc = xmldoc
-        unit = xmldoc.xpath('/alto:alto/alto:Description/alto:MeasurementUnit', namespaces=ns)[0].text
-        xres = image_resolution[0]
-        yres = image_resolution[1]
-
-        if unit == 'inch1200':
-            self.scale = (xres / 1200.0, yres / 1200.0)
-        elif unit == 'mm10':
-            self.scale = (xres / 254.0, yres / 254.0)
-        elif unit == 'pixel':
-            self.scale = (1, 1)
-        else:
-            raise Exception("Unknown MeasurementUnit " + unit)
-
-    def textblocks(self):
-        for node in self.xmldoc.xpath("//alto:TextBlock", namespaces=ns):
-            yield TextBlock(node)
-
-    def textblock(self, id):
-        return TextBlock(self.xmldoc.xpath("//alto:TextBlock[@ID=$id]", id=id, namespaces=ns)[0])
-
-
-class Region(object):
-    def __init__(self, element):
-        self.element = element
-        self.id = self.element.get('ID')
-        self.hpos = int(self.element.get('HPOS'))
-        self.vpos = int(self.element.get('VPOS'))
-        self.width = int(self.element.get('WIDTH'))
-        self.height = int(self.element.get('HEIGHT'))
-
-    def xywh(self, scale):
-        xscale = scale[0]
-        yscale = scale[1]
-        x = round(self.hpos * xscale)
-        y = round(self.vpos * yscale)
-        w = round(self.width * xscale)
-        h = round(self.height * yscale)
-
-        return x, y, w, h
-
-    def bbox(self, scale):
-        (x, y, w, h) = self.xywh(scale)
-        return x, y, x + w, y + h
-
-
-class TextBlock(Region):
-    def lines(self):
-        for node in self.element.xpath('alto:TextLine', namespaces=ns):
-            yield TextLine(node)
-
-    def text(self, scale=None):
-        return "\n".join([line.text(scale) for line in self.lines()])
-
-
-class TextLine(Region):
-    def inlines(self):
-        for node in self.element.xpath('alto:String|alto:SP|alto:HYP', namespaces=ns):
-            tag = etree.QName(node.tag)
-            if tag.localname == 'String':
-                yield String(node)
-            elif tag.localname == 'SP':
-                yield Space(node)
-            elif tag.localname == 'HYP':
-                yield Hyphen(node)
-
-    def text(self, scale=None):
-        return ''.join([inline.text(scale) for inline in self.inlines()])
-
-
-class String(Region):
-    def text(self, scale=None):
-        text = self.element.get('CONTENT')
+ALTO_MEASUREMENT_UNIT = f"{{{ns['alto']}}}MeasurementUnit"
+ALTO_TEXT_BLOCK = f"{{{ns['alto']}}}TextBlock"
+ALTO_TEXT_LINE = f"{{{ns['alto']}}}TextLine"
+ALTO_STRING = f"{{{ns['alto']}}}String"
+ALTO_SP = f"{{{ns['alto']}}}SP"
+ALTO_HYP = f"{{{ns['alto']}}}HYP"
+
+# number of text blocks whose coordinates iter_textblocks scales at a time
+TEXTBLOCK_BATCH_SIZE = 100
+
+SPACE_TEXT = ' '
+HYPHEN_TEXT = '\N{SOFT HYPHEN}'
+# format of a string in the text of an annotation: its content and its scaled x, y, width, and height
+STRING_TEMPLATE = '{}|{},{},{},{}'
+# separates the text blocks of a batch while they are formatted together; cannot occur in XML text
+BLOCK_SEPARATOR = '\x00'
+
+
+def get_scale(unit, image_resolution):
+    """The (x, y) factors that convert ALTO coordinates in the given MeasurementUnit to image pixels"""
+    xres = image_resolution[0]
+    yres = image_resolution[1]
+
+    if unit == 'inch1200':
+        return xres / 1200.0, yres / 1200.0
+    elif unit == 'mm10':
+        return xres / 254.0, yres / 254.0
+    elif unit == 'pixel':
+        return 1, 1
+    else:
+        raise Exception("Unknown MeasurementUnit " + unit)
+
+
+def iter_textblocks(stream, image_resolution, batch_size=TEXTBLOCK_BATCH_SIZE):
+    """
+    Generator of the text blocks of an ALTO document, as ScaledTextBlock
+    objects with their coordinates already converted to image pixels. The
+    document is parsed incrementally from stream, and each TextBlock element
+    is discarded once it has been read. The coordinates of up to batch_size
+    text blocks at a time are scaled together in one NumPy operation, so
+    memory use is bounded by the batch size, however large the page.
+    """
+    scale = None
+    batch = TextBlockBatch()
+    for event, element in etree.iterparse(stream, events=('end',), tag=(ALTO_MEASUREMENT_UNIT, ALTO_TEXT_BLOCK)):
+        if element.tag == ALTO_MEASUREMENT_UNIT:
+            scale = get_scale(element.text, image_resolution)
+            continue
         if scale is None:
-            return text
-        xywh = ','.join([str(i) for i in self.xywh(scale)])
-        return '{0}|{1}'.format(text, xywh)
-
-
-class Space(object):
-    def __init__(self, element):
-        self.element = element
-        super(Space, self).__init__()
-
-    def text(self, scale=None):
-        return ' '
-
-
-class Hyphen(object):
-    def __init__(self, element):
-        self.element = element
-        super(Hyphen, self).__init__()
-
-    def text(self, scale=None):
-        return '\N{SOFT HYPHEN}'
+            raise Exception("No MeasurementUnit before the first TextBlock")
+        batch.add(element)
+
+        # free the block, and the already-read siblings that precede it
+        element.clear()
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
+
+        if len(batch) >= batch_size:
+            yield from batch.scale(scale)
+            batch = TextBlockBatch()
+
+    yield from batch.scale(scale)
+
+
+class TextBlockBatch(object):
+    """
+    Text blocks read from ALTO elements whose coordinates have not been scaled
+    yet. The text of each block is kept as a format template with a
+    STRING_TEMPLATE for each string, and the contents and unscaled coordinates
+    of all the strings are collected in flat lists in document order, so
+    scaling and formatting the whole batch are each done in one step.
+    """
+    def __init__(self):
+        self.ids = []
+        self.templates = []
+        self.block_coordinates = []
+        self.contents = []
+        self.string_coordinates = []
+        # number of strings before each block, to find the block a string belongs to
+        self.string_offsets = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, element):
+        contents = self.contents
+        coordinates = self.string_coordinates
+        self.ids.append(element.get('ID'))
+        self.string_offsets.append(len(contents))
+        self.block_coordinates.extend((
+            element.get('HPOS'), element.get('VPOS'), element.get('WIDTH'), element.get('HEIGHT')
+        ))
+        lines = []
+        for line_element in element.iterchildren(ALTO_TEXT_LINE):
+            pieces = []
+            for node in line_element.iterchildren(ALTO_STRING, ALTO_SP, ALTO_HYP):
+                tag = node.tag
+                if tag == ALTO_STRING:
+                    pieces.append(STRING_TEMPLATE)
+                    contents.append(node.get('CONTENT'))
+                    coordinates.extend((node.get('HPOS'), node.get('VPOS'), node.get('WIDTH'), node.get('HEIGHT')))
+                elif tag == ALTO_SP:
+                    pieces.append(SPACE_TEXT)
+                elif tag == ALTO_HYP:
+                    pieces.append(HYPHEN_TEXT)
+            lines.append(''.join(pieces))
+        self.templates.append('\n'.join(lines))
+
+    def scale(self, scale):
+        """Scale all the coordinates at once, and return the finished text blocks"""
+        if not self.ids:
+            return []
+        factors = np.array([scale[0], scale[1], scale[0], scale[1]])
+        try:
+            blocks = scale_coordinates(self.block_coordinates, factors)
+        except ValueError as e:
+            block_id = self.ids[e.args[0]]
+            raise DataReadException(f'TextBlock "{block_id}" has a missing or invalid position or size')
+        try:
+            strings = scale_coordinates(self.string_coordinates, factors)
+        except ValueError as e:
+            block_id = self.ids[bisect_right(self.string_offsets, e.args[0]) - 1]
+            raise DataReadException(f'A String in TextBlock "{block_id}" has a missing or invalid position or size')
+
+        # fill in every string of every block with a single format call
+        values = np.empty((len(self.contents), 5), dtype=object)
+        values[:, 0] = self.contents
+        values[:, 1:] = strings
+        texts = BLOCK_SEPARATOR.join(self.templates).format(*values.ravel().tolist()).split(BLOCK_SEPARATOR)
+
+        return [ScaledTextBlock(*block) for block in zip(self.ids, map(tuple, blocks.tolist()), texts)]
+
+
+def scale_coordinates(coordinates, factors):
+    """
+    Convert a flat list of (HPOS, VPOS, WIDTH, HEIGHT) attribute values to an
+    array of scaled (x, y, w, h) rows. Raises ValueError, with the number of
+    the first row that has a missing or non-numeric value, instead of letting
+    that value turn into a meaningless integer.
+    """
+    try:
+        array = np.array(coordinates, dtype=np.float64).reshape(-1, 4)
+    except ValueError:
+        raise ValueError(first_invalid_row(coordinates))
+    # a missing attribute becomes NaN
+    if not np.isfinite(array).all():
+        raise ValueError(first_invalid_row(coordinates))
+    # np.rint rounds halves to even, the same as the built-in round()
+    return np.rint(array * factors).astype(np.int64)
+
+
+def first_invalid_row(coordinates):
+    for i, value in enumerate(coordinates):
+        try:
+            if math.isfinite(float(value)):
+                continue
+        except (TypeError, ValueError):
+            pass
+        return i // 4
+
+
+class ScaledTextBlock(object):
+    """The id, scaled coordinates, and text of a TextBlock, detached from the ALTO document"""
+    def __init__(self, id, xywh, text):
+        self.id = id
+        self.xywh = xywh
+        self.text_value = text
+
+    def text(self):
+        """The block's lines, with "content|x,y,w,h" for each string, and the spaces and hyphens between them"""
+        return self.text_value
@@ -1,8 +1,10 @@
+import hashlib
 from rdflib import URIRef
 from plastron import ldp, ore, rdf
-from plastron.exceptions import RESTAPIException
+from plastron.exceptions import DataReadException, RESTAPIException
+from plastron.images import ImageDimensions
 from plastron.namespaces import dcterms, dcmitype, ebucore, fabio, pcdm, pcdmuse
-from plastron.util import LocalFile
+from plastron.util import LocalFile, ObservedStream, digest_matches
 from PIL import Image
 
 # alias the rdflib Namespace
@@ -42,6 +44,11 @@ class File(ldp.Resource):
         super().__init__(**kwargs)
         self.source = source
         self.filename = source.filename
+        # SHA-1 of the data that was read from the source during upload
+        self.uploaded_digest = None
+        self.digest_verified = False
+        # true if only a placeholder was created, to be filled in by a later upload
+        self.deferred = False
         if self.title is None:
             self.title = self.filename
 
@@ -56,18 +63,19 @@ class File(ldp.Resource):
             self.created = True
             return False
 
-        self.logger.info(f'Loading {self.source.filename}')
+        if uri is None and self.minted:
+            uri = self.uri
+
+        external_url = None
+        if repository.external_content is not None:
+            external_url = repository.external_content.url_for(self.source)
 
-        with self.source.data() as stream:
-            headers = {
-                'Content-Type': self.source.mimetype(),
-                'Digest': self.source.digest(),
-                'Content-Disposition': f'attachment; filename="{self.source.filename}"'
-            }
-            if uri is not None:
-                response = repository.put(uri, data=stream, headers=headers)
-            else:
-                response = repository.post(repository.uri(), data=stream, headers=headers)
+        if external_url is not None:
+            response = self.create_reference(repository, external_url, uri)
+        elif repository.defer_binaries and isinstance(self.source, LocalFile):
+            response = self.create_placeholder(repository, uri)
+        else:
+            response = self.upload(repository, uri)
 
         if response.status_code == 201:
             self.uri = URIRef(response.headers['Location'])
@@ -76,28 +84,125 @@ class File(ldp.Resource):
         else:
             raise RESTAPIException(response)
 
+    def upload(self, repository, uri=None):
+        self.logger.info(f'Loading {self.source.filename}')
+
+        # read the source only once: hash it, and look for the image dimensions
+        # if we need them, while it is being uploaded
+        sha1 = hashlib.sha1()
+        observers = [sha1]
+        dimensions = None
+        if self.needs_dimensions():
+            dimensions = ImageDimensions()
+            observers.append(dimensions)
+
+        headers = {
+            'Content-Type': self.source.mimetype(),
+            'Content-Disposition': f'attachment; filename="{self.source.filename}"'
+        }
+        # if we already know the digest, the repository can check it as it
+        # receives the data; otherwise it is checked after the upload
+        precomputed_digest = self.source.precomputed_digest()
+        if precomputed_digest is not None:
+            headers['Digest'] = precomputed_digest
+
+        with ObservedStream(self.source.data(), observers) as stream:
+            response = self.send(repository, uri, data=stream, headers=headers)
+
+        # 204 is the response to replacing the content of an existing binary
+        if response.status_code in (201, 204):
+            self.uploaded_digest = 'sha1=' + sha1.hexdigest()
+            self.source.record_digest(self.uploaded_digest)
+            self.digest_verified = precomputed_digest is not None
+            if dimensions is not None and dimensions.width is not None and dimensions.height is not None:
+                self.width = dimensions.width
+                self.height = dimensions.height
+        return response
+
+    # create the binary as a reference to a URL where the repository can get the content itself
+    def create_reference(self, repository, url, uri=None):
+        self.logger.info(f'Loading {self.source.filename} as external content at {url}')
+        headers = {
+            'Content-Type': f'message/external-body; access-type=URL; URL="{url}"',
+            'Content-Disposition': f'attachment; filename="{self.source.filename}"'
+        }
+        response = self.send(repository, uri, headers=headers)
+
+        if response.status_code == 201 and repository.external_content.verify_digest:
+            # compare the local copy with what the repository reports for the
+            # external content when the binary is updated
+            self.uploaded_digest = self.source.digest()
+            self.digest_verified = False
+        return response
+
+    # create an empty binary that reserves the URI and carries the metadata
+    # until the content is uploaded by a later "load --binaries-only"
+    def create_placeholder(self, repository, uri=None):
+        self.logger.info(f'Creating placeholder for {self.source.filename}')
+        headers = {
+            'Content-Type': self.source.mimetype(),
+            'Content-Disposition': f'attachment; filename="{self.source.filename}"'
+        }
+        response = self.send(repository, uri, data=b'', headers=headers)
+        if response.status_code == 201:
+            self.deferred = True
+        return response
+
+    @staticmethod
+    def send(repository, uri=None, **kwargs):
+        if uri is not None:
+            return repository.put(uri, **kwargs)
+        else:
+            return repository.post(repository.uri(), **kwargs)
+
+    def needs_dimensions(self):
+        return self.source.mimetype().startswith('image/') and (len(self.width) == 0 or len(self.height) == 0)
+
+    def verify_digest(self, head_response):
+        # without a digest from the repository, nothing has checked that the
+        # data arrived intact, so the binary can't be accepted
+        if 'Digest' not in head_response.headers:
+            raise DataReadException(f'Repository did not report a digest for {self.uri}; cannot verify upload')
+        if not digest_matches(self.uploaded_digest, head_response.headers['Digest']):
+            raise DataReadException(
+                f'Digest of {self.uri} ({head_response.headers["Digest"]}) does not match '
+                f'the data read from {self.source.filename} ({self.uploaded_digest})'
+            )
+        self.digest_verified = True
+
+    def recursive_mint(self, repository):
+        # binaries that are not going to be loaded should not be linked to
+        if repository.load_binaries:
+            super().recursive_mint(repository)
+
     def update_object(self, repository, patch_uri=None):
         if not repository.load_binaries:
             self.logger.info(f'Skipping update for binary {self.source.filename}')
             return True
 
-        # if this is an image file, see if we can get dimensions
-        if self.source.mimetype().startswith('image/'):
-            if self.width is None or self.height is None:
-                # use PIL
-                try:
-                    with Image.open(self.source.data()) as img:
-                        self.width = img.width
-                        self.height = img.height
-                except IOError as e:
-                    self.logger.warn(f'Cannot read image file: {e}')
-
-        head_response = repository.head(self.uri)
+        # if this is an image file whose dimensions weren't found during the
+        # upload (e.g., a format we can't read from the stream), try PIL
+        if self.needs_dimensions():
+            try:
+                with Image.open(self.source.data()) as img:
+                    self.width = img.width
+                    self.height = img.height
+            except IOError as e:
+                self.logger.warn(f'Cannot read image file: {e}')
+
+        if self.uploaded_digest is not None and not self.digest_verified:
+            headers = {'Want-Digest': 'sha'}
+        else:
+            headers = {}
+        head_response = repository.head(self.uri, headers=headers)
         if 'describedby' in head_response.links:
             target = head_response.links['describedby']['url']
         else:
             raise Exception(f'Missing describedby Link header for {self.uri}')
 
+        if 'Want-Digest' in headers:
+            self.verify_digest(head_response)
+
         return super().update_object(repository, patch_uri=target)
 
 
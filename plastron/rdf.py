@@ -84,6 +84,17 @@ class RDFProperty(object):
             if value is not None:
                 yield (subject, self.uri, self.get_term(value))
 
+    def __reduce__(self):
+        # property classes are created on the fly by the property decorators,
+        # so they can't be pickled by name; look them up on their owner instead
+        return restore_property, (self.owner, self.name, self.values)
+
+
+def restore_property(owner, name, values):
+    prop = owner.name_to_prop[name]()
+    prop.values = values
+    return prop
+
 
 class RDFDataProperty(RDFProperty):
     @classmethod
@@ -121,7 +132,8 @@ def data_property(name, uri):
         type_name = f'{cls.__name__}.{name}'
         prop_type = type(type_name, (RDFDataProperty,), {
             'name': name,
-            'uri': uri
+            'uri': uri,
+            'owner': cls
         })
         cls.name_to_prop[name] = prop_type
         cls.uri_to_prop[uri] = prop_type
@@ -223,7 +235,7 @@ class Resource(metaclass=Meta):
         # hash URI identifiers
         for obj in self.embedded_objects():
             if obj is not None:
-                graph = graph + obj.graph()
+                graph += obj.graph()
 
         # any triples that were loaded from the source graph but that aren't
         # mapped to specific Python attributes
@@ -255,7 +267,8 @@ def object_property(name, uri, embed=False, obj_class=None):
             'name': name,
             'uri': uri,
             'is_embedded': embed,
-            'obj_class': obj_class
+            'obj_class': obj_class,
+            'owner': cls
         })
         cls.name_to_prop[name] = prop_type
         cls.uri_to_prop[uri] = prop_type
@@ -0,0 +1,146 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime as dt
+from itertools import chain
+
+DEFAULT_WIDTH = 8
+
+
+class Operation:
+    """A single create or update request for one object, and the operations
+    that have to wait for it to finish before they can run."""
+    def __init__(self, name, obj, func):
+        self.name = name
+        self.obj = obj
+        self.func = func
+        self.waiting_on = 0
+        self.dependents = []
+
+    def __str__(self):
+        return f'{self.name} {self.obj}'
+
+    def __call__(self):
+        return self.func()
+
+    def depends_on(self, other):
+        if other is not None and other is not self:
+            other.dependents.append(self)
+            self.waiting_on += 1
+
+
+class WriteScheduler:
+    """
+    Runs the create and update requests for one or more object graphs
+    concurrently, using the links between the objects to decide which requests
+    have to wait for which. Creating an object does not depend on anything, but
+    updating an object has to wait until it and every object it links to have
+    been created, since those URIs end up in the update. The result in the
+    repository is the same as that of recursive_create() followed by
+    recursive_update().
+
+    All the requests are sent to the repository's current path and within
+    its current transaction, so objects that need to be created under a
+    different path (e.g., annotations) should be written in a separate call
+    to write().
+    """
+    def __init__(self, repository, width=DEFAULT_WIDTH):
+        self.repository = repository
+        self.width = width
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+    def write(self, *roots, before_update=None):
+        """
+        Create and update the given objects and all of their linked objects
+        that are not already up to date. If given, before_update is called with
+        each root object after it has been created but before it is updated.
+        """
+        objects = self.collect(roots)
+        operations = self.plan(objects, roots, before_update)
+        self.logger.debug(f'Scheduled {len(operations)} operation(s) for {len(objects)} object(s)')
+        self.run(operations)
+
+    def collect(self, roots):
+        # same traversal as recursive_update(), which stops at objects that are
+        # already up to date in the repository
+        objects = {}
+        queue = deque(roots)
+        while queue:
+            obj = queue.popleft()
+            if id(obj) in objects or obj.updated:
+                continue
+            objects[id(obj)] = obj
+            queue.extend(obj.linked_objects())
+        return list(objects.values())
+
+    def plan(self, objects, roots, before_update=None):
+        creates = {}
+        updates = []
+        for obj in objects:
+            if not obj.created:
+                creates[id(obj)] = Operation('Create', obj, self._create_func(obj))
+        root_ids = set(id(root) for root in roots)
+        for obj in objects:
+            prepare = before_update if id(obj) in root_ids else None
+            update = Operation('Update', obj, self._update_func(obj, prepare))
+            update.depends_on(creates.get(id(obj)))
+            for target in link_targets(obj):
+                update.depends_on(creates.get(id(target)))
+            updates.append(update)
+        return list(creates.values()) + updates
+
+    def _create_func(self, obj):
+        def create():
+            if obj.create_object(self.repository):
+                obj.creation_timestamp = dt.now()
+            else:
+                self.logger.debug(f'Object "{obj}" exists. Skipping.')
+        return create
+
+    def _update_func(self, obj, prepare=None):
+        def update():
+            if prepare is not None:
+                prepare(obj)
+            obj.update_object(self.repository)
+        return update
+
+    def run(self, operations):
+        ready = deque(op for op in operations if op.waiting_on == 0)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.width) as executor:
+            while ready or running:
+                # once something has failed, let the running operations finish
+                # but don't start any new ones
+                while ready and error is None and len(running) < self.width:
+                    op = ready.popleft()
+                    running[executor.submit(op)] = op
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    op = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.logger.error(f'{op} failed: {e}')
+                        if error is None:
+                            error = e
+                        continue
+                    for dependent in op.dependents:
+                        dependent.waiting_on -= 1
+                        if dependent.waiting_on == 0:
+                            ready.append(dependent)
+        if error is not None:
+            raise error
+
+
+def link_targets(obj):
+    """Objects linked to from obj or from any of the objects embedded in it."""
+    for resource in chain([obj], obj.embedded_objects()):
+        if resource is None:
+            continue
+        for prop in resource.object_properties():
+            for value in prop.values:
+                if hasattr(value, 'uri'):
+                    yield value
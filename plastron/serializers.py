@@ -1,20 +1,30 @@
 import csv
+import gzip
+import io
+import json
 import logging
 import os
+import pickle
 from collections import defaultdict
-from tempfile import NamedTemporaryFile
+from tempfile import TemporaryFile
 from urllib.parse import urlparse
-from zipfile import ZipFile
+from zipfile import ZipFile, is_zipfile
 
 from rdflib import Literal, Graph, URIRef
 
-from plastron.exceptions import DataReadException
+from plastron.exceptions import ConfigException, DataReadException
 from plastron.models.letter import Letter
 from plastron.models.newspaper import Issue
 from plastron.models.poster import Poster
 from plastron.namespaces import get_manager, bibo, rdf, fedora
+from plastron.ntriples import encode_quad, encode_triple
 from plastron.rdf import RDFObjectProperty, RDFDataProperty, Resource
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 logger = logging.getLogger(__name__)
 nsm = get_manager()
 
@@ -25,23 +35,93 @@ MODEL_MAP = {
 }
 
 
-class TurtleSerializer:
-    def __init__(self, filename, **kwargs):
+# file extension and content type of the export file for each kind of compression
+COMPRESSION_TYPES = {
+    'gzip': ('.gz', 'application/gzip'),
+    'zstd': ('.zst', 'application/zstd')
+}
+
+
+def open_output(filename, compression=None):
+    """Opens filename for writing bytes, compressing them as they are written if compression is given"""
+    if compression is None:
+        return open(filename, 'wb')
+    elif compression == 'gzip':
+        return gzip.open(filename, 'wb')
+    elif compression == 'zstd':
+        return zstandard.ZstdCompressor().stream_writer(open(filename, 'wb'))
+
+
+class StreamSerializer:
+    """
+    Base class for serializers that write each graph to the export file as
+    soon as they receive it, optionally compressed, so exports of any size
+    are written in constant memory.
+    """
+    content_type = 'application/octet-stream'
+    file_extension = ''
+
+    def __init__(self, filename, compression=None, **kwargs):
+        if compression is not None:
+            if compression not in COMPRESSION_TYPES:
+                raise ConfigException(f'Unknown compression: {compression}')
+            if compression == 'zstd' and zstandard is None:
+                raise ConfigException('zstd compression requires the zstandard package')
+            extension, self.content_type = COMPRESSION_TYPES[compression]
+            self.file_extension += extension
         self.filename = filename
-        self.content_type = 'text/turtle'
-        self.file_extension = '.ttl'
+        self.compression = compression
 
     def __enter__(self):
-        self.fh = open(self.filename, 'wb')
+        self.fh = open_output(self.filename, self.compression)
         return self
 
     def write(self, graph):
-        graph.serialize(destination=self.fh, format='turtle')
+        raise NotImplementedError
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.fh.close()
 
 
+class TurtleSerializer(StreamSerializer):
+    content_type = 'text/turtle'
+    file_extension = '.ttl'
+
+    def write(self, graph):
+        graph.serialize(destination=self.fh, format='turtle')
+
+
+class NTriplesSerializer(StreamSerializer):
+    """One triple per line, with no prefixes to compute, so graphs can simply be appended"""
+    content_type = 'application/n-triples'
+    file_extension = '.nt'
+
+    def write(self, graph):
+        self.fh.write(''.join(encode_triple(triple) for triple in graph).encode('utf-8'))
+
+
+class NQuadsSerializer(StreamSerializer):
+    """Like N-Triples, but each triple is in the named graph of the resource it describes"""
+    content_type = 'application/n-quads'
+    file_extension = '.nq'
+
+    def write(self, graph):
+        graph_name = get_main_subject(graph)
+        self.fh.write(''.join(encode_quad(triple, graph_name) for triple in graph).encode('utf-8'))
+
+
+def get_main_subject(graph):
+    return set([s for s in graph.subjects() if '#' not in str(s)]).pop()
+
+
+def get_model_class(name):
+    """The content model class with the given name, or None if there isn't one"""
+    for resource_class in MODEL_MAP.values():
+        if resource_class.__name__ == name:
+            return resource_class
+    return None
+
+
 def detect_resource_class(graph, subject):
     types = set([o for s, p, o in graph.triples((subject, rdf.type, None))])
 
@@ -53,25 +133,113 @@ def detect_resource_class(graph, subject):
 
 
 def write_csv_file(row_info, file):
-    # sort and add the new headers that have language names or datatypes
-    for header, new_headers in row_info['extra_headers'].items():
-        header_index = row_info['headers'].index(header)
-        for i, new_header in enumerate(sorted(new_headers), start=1):
-            row_info['headers'].insert(header_index + i, new_header)
+    # add the new headers that have language names or datatypes, sorted, after their base headers
+    headers = []
+    for header in row_info['headers']:
+        headers.append(header)
+        headers.extend(sorted(row_info['extra_headers'].get(header, ())))
 
     # strip out headers that aren't used in any row
-    for header in row_info['headers']:
-        has_column_values = any([True for row in row_info['rows'] if header in row])
-        if not has_column_values:
-            row_info['headers'].remove(header)
+    used_headers = row_info['rows'].headers
+    headers = [header for header in headers if header in used_headers]
 
     # write the CSV file
-    csv_writer = csv.DictWriter(file, row_info['headers'], extrasaction='ignore')
+    csv_writer = csv.DictWriter(file, headers, extrasaction='ignore')
     csv_writer.writeheader()
     for row in row_info['rows']:
         csv_writer.writerow(row)
 
 
+def get_base_header(header, headers):
+    """The header that a column for a language or datatype (e.g., "Title [Japanese]") belongs to"""
+    for base in headers:
+        if header.startswith(base + ' [') or header.startswith(base + ' {'):
+            return base
+    return header
+
+
+def detect_csv_model(headers, preferred=()):
+    """
+    The content model whose CSV export could have the given headers. If more
+    than one could, and exactly one of them is in preferred, that one is
+    chosen. Otherwise, returns None if there isn't exactly one.
+    """
+    candidates = []
+    for resource_class in MODEL_MAP.values():
+        model_headers = list(resource_class.HEADER_MAP.values()) + CSVSerializer.SYSTEM_HEADERS
+        if all(get_base_header(header, model_headers) in model_headers for header in headers):
+            candidates.append(resource_class)
+    if len(candidates) > 1:
+        candidates = [resource_class for resource_class in candidates if resource_class in preferred]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def read_csv_export(filename, preferred=()):
+    """
+    Generator of (content model class, csv.DictReader) pairs for each CSV
+    file in an export written by CSVSerializer. A single CSV file does not
+    record its content model, so it is detected from the headers, with
+    preferred used to settle any ambiguity (see detect_csv_model).
+    """
+    if is_zipfile(filename):
+        classes = {resource_class.__name__ + '.csv': resource_class for resource_class in MODEL_MAP.values()}
+        with ZipFile(filename) as zip_fh:
+            for name in zip_fh.namelist():
+                if name not in classes:
+                    raise DataReadException(f'Unknown content model file {name} in {filename}')
+                with zip_fh.open(name) as entry:
+                    yield classes[name], csv.DictReader(io.TextIOWrapper(entry, encoding='utf-8', newline=''))
+    else:
+        with open(filename, newline='') as fh:
+            reader = csv.DictReader(fh)
+            resource_class = detect_csv_model(reader.fieldnames or [], preferred)
+            if resource_class is None:
+                raise DataReadException(f'Unable to determine the content model of {filename}')
+            yield resource_class, reader
+
+
+class SpooledRows:
+    """
+    CSV rows that are kept in a temporary file instead of in memory, until
+    the full set of headers is known and the CSV file can be written. Each
+    row is stored as a list of (column number, value) pairs; the set of
+    headers that have values in at least one row is kept as rows are added.
+    """
+    def __init__(self):
+        # not created until the first row is added
+        self.file = None
+        # column numbers, by header
+        self.columns = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def headers(self):
+        return self.columns.keys()
+
+    def append(self, row):
+        columns = self.columns
+        pairs = [(columns.setdefault(header, len(columns)), value) for header, value in row.items()]
+        if self.file is None:
+            self.file = TemporaryFile()
+        pickle.dump(pairs, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def __iter__(self):
+        if self.file is None:
+            return
+        headers = list(self.columns)
+        self.file.seek(0)
+        for _ in range(self.count):
+            yield {headers[column]: value for column, value in pickle.load(self.file)}
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
 class CSVSerializer:
     def __init__(self, filename, **kwargs):
         self.filename = filename
@@ -79,9 +247,10 @@ class CSVSerializer:
         self.content_type = 'text/csv'
         self.file_extension = '.csv'
         self.public_uri_template = kwargs.get('public_uri_template', None)
+        if kwargs.get('compression', None) is not None:
+            raise ConfigException('Compression is not supported for CSV export')
 
     def __enter__(self):
-        self.rows = []
         return self
 
     SYSTEM_HEADERS = ['URI', 'PUBLIC URI', 'CREATED', 'MODIFIED', 'INDEX']
@@ -90,27 +259,70 @@ class CSVSerializer:
         """
         Serializes the given graph as CSV data rows.
         """
-        main_subject = set([s for s in graph.subjects() if '#' not in str(s)]).pop()
+        resource_class, main_subject, columns = self.flatten_graph(graph)
+        row = {k: ';'.join(v) for k, v in columns.items()}
+        row.update(self.system_values(graph, main_subject))
+
+        self.content_models[resource_class]['rows'].append(row)
+
+    def flatten_graph(self, graph: Graph):
+        """
+        Returns the content model class of the resource described by the given
+        graph, its URI, and its values, as lists by column header.
+        """
+        main_subject = get_main_subject(graph)
         resource_class = detect_resource_class(graph, main_subject)
+        resource = resource_class.from_graph(graph, subject=main_subject)
+        return resource_class, main_subject, self.flatten(resource, self.get_row_info(resource_class))
+
+    def get_row_info(self, resource_class):
         if resource_class not in self.content_models:
             self.content_models[resource_class] = {
                 'header_map': resource_class.HEADER_MAP,
                 'headers': list(resource_class.HEADER_MAP.values()) + self.SYSTEM_HEADERS,
                 'extra_headers': defaultdict(set),
-                'rows': []
+                'rows': SpooledRows()
             }
-
-        resource = resource_class.from_graph(graph, subject=main_subject)
-        row = {k: ';'.join(v) for k, v in self.flatten(resource, self.content_models[resource_class]).items()}
-        row['URI'] = str(main_subject)
-        row['CREATED'] = str(graph.value(main_subject, fedora.created))
-        row['MODIFIED'] = str(graph.value(main_subject, fedora.lastModified))
+        return self.content_models[resource_class]
+
+    def system_values(self, graph, main_subject):
+        values = {
+            'URI': str(main_subject),
+            'CREATED': str(graph.value(main_subject, fedora.created)),
+            'MODIFIED': str(graph.value(main_subject, fedora.lastModified))
+        }
         if self.public_uri_template is not None:
             uri = urlparse(main_subject)
             uuid = os.path.basename(uri.path)
-            row['PUBLIC URI'] = self.public_uri_template.format(uuid=uuid)
+            values['PUBLIC URI'] = self.public_uri_template.format(uuid=uuid)
+        return values
 
-        self.content_models[resource_class]['rows'].append(row)
+    def merge(self, filename, uris, models=None):
+        """
+        Adds the rows for the given URIs from an earlier CSV export (a CSV
+        file, or a ZIP file of them) to this one, as they are. The names of
+        the content models of those rows, if known, settle which model a
+        single CSV file holds. Returns the number of rows added.
+        """
+        uris = set(uris)
+        count = 0
+        if models:
+            preferred = [get_model_class(name) for name in models]
+        else:
+            # a CSV file that could hold rows of several content models most likely holds the ones already exported
+            preferred = list(self.content_models)
+        for resource_class, reader in read_csv_export(filename, preferred=preferred):
+            row_info = self.get_row_info(resource_class)
+            for row in reader:
+                if row.get('URI') not in uris:
+                    continue
+                for header in row:
+                    base = get_base_header(header, row_info['headers'])
+                    if base != header:
+                        row_info['extra_headers'][base].add(header)
+                row_info['rows'].append(row)
+                count += 1
+        return count
 
     LANGUAGE_NAMES = {
         'ja': 'Japanese',
@@ -172,6 +384,13 @@ class CSVSerializer:
         return columns
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.write_files()
+        finally:
+            for row_info in self.content_models.values():
+                row_info['rows'].close()
+
+    def write_files(self):
         if len(self.content_models) == 0:
             logger.error("No items could be exported; skipping writing file")
         elif len(self.content_models) == 1:
@@ -182,22 +401,48 @@ class CSVSerializer:
             # write a ZIP file containing individual CSV files
             with ZipFile(self.filename, mode='w') as zip_fh:
                 for resource_class, row_info in self.content_models.items():
-                    # write the CSV file
-                    tmp = NamedTemporaryFile(mode='w', encoding='utf-8', delete=False)
-                    write_csv_file(row_info, file=tmp)
-                    tmp.close()
-                    # add the CSV file to the ZIP file
-                    zip_fh.write(tmp.name, arcname=resource_class.__name__ + '.csv')
-                    os.remove(tmp.name)
+                    # write the CSV file directly into the ZIP file
+                    with zip_fh.open(resource_class.__name__ + '.csv', mode='w') as entry:
+                        with io.TextIOWrapper(entry, encoding='utf-8', newline='') as fh:
+                            write_csv_file(row_info, file=fh)
             # multi-content model CSV export actually produces ZIP files
             self.content_type = 'application/zip'
             self.file_extension = '.zip'
 
 
+class JSONLinesSerializer(StreamSerializer):
+    """
+    One JSON object per line for each resource, with the same columns as the
+    CSV export. Each column holds the list of its values, and the system
+    columns (URI, CREATED, etc.) hold a single string.
+    """
+    content_type = 'application/jsonl'
+    file_extension = '.jsonl'
+
+    def __init__(self, filename, compression=None, **kwargs):
+        super().__init__(filename, compression=compression)
+        # only used to flatten resources, never to write a CSV file
+        self.flattener = CSVSerializer(filename, public_uri_template=kwargs.get('public_uri_template', None))
+
+    def write(self, graph: Graph):
+        resource_class, main_subject, columns = self.flattener.flatten_graph(graph)
+        record = dict(columns)
+        record.update(self.flattener.system_values(graph, main_subject))
+        self.fh.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+
+
 SERIALIZER_CLASSES = {
     'text/turtle': TurtleSerializer,
     'turtle': TurtleSerializer,
     'ttl': TurtleSerializer,
     'text/csv': CSVSerializer,
-    'csv': CSVSerializer
+    'csv': CSVSerializer,
+    'application/n-triples': NTriplesSerializer,
+    'ntriples': NTriplesSerializer,
+    'nt': NTriplesSerializer,
+    'application/n-quads': NQuadsSerializer,
+    'nquads': NQuadsSerializer,
+    'nq': NQuadsSerializer,
+    'application/jsonl': JSONLinesSerializer,
+    'jsonl': JSONLinesSerializer
 }
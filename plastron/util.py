@@ -1,14 +1,20 @@
+import atexit
+import base64
 import csv
 import hashlib
 import logging
 import mimetypes
-import shutil
+import mmap
+import os
+import sqlite3
 import sys
+import threading
 from os.path import basename, isfile
-from tempfile import NamedTemporaryFile
+from urllib.parse import quote
+import requests
 from paramiko import SSHClient, SFTPClient
 from plastron import namespaces
-from plastron.exceptions import RESTAPIException, FailureException
+from plastron.exceptions import DataReadException, RESTAPIException, FailureException
 from plastron.http import Transaction
 from plastron.namespaces import dcterms, ebucore
 from rdflib import URIRef
@@ -16,6 +22,10 @@ from rdflib.util import from_n3
 
 logger = logging.getLogger(__name__)
 
+# size of the reads when streaming binary data through an ObservedStream
+# or computing digests
+STREAM_BLOCK_SIZE = 1024 * 1024
+
 
 def get_title_string(graph, separator='; '):
     return separator.join([t for t in graph.objects(predicate=dcterms.title)])
@@ -28,6 +38,36 @@ def parse_predicate_list(string, delimiter=','):
     return [from_n3(p, nsm=manager) for p in string.split(delimiter)]
 
 
+def raise_fetch_error(uri, exception):
+    logger.error(f'Unable to retrieve {uri}: {exception}')
+    if isinstance(exception, (RESTAPIException, requests.RequestException)):
+        raise exception
+    # e.g., a description that could not be parsed
+    raise DataReadException(f'Unable to read {uri}: {exception}') from exception
+
+
+def check_interrupted(interrupted):
+    """
+    Raises KeyboardInterrupt in a worker thread if the interrupted event has
+    been set, since only the main thread receives the real interrupt. Lets a
+    worker stop at a point where it can clean up after itself.
+    """
+    if interrupted is not None and interrupted.is_set():
+        raise KeyboardInterrupt()
+
+
+def finished_results(futures):
+    """
+    Generator of (key, result) pairs for the futures in a dict of futures to
+    keys that ran to completion without raising an exception. Meant for once
+    the executor has shut down, to account for the work that was still in
+    progress when the loop collecting the results stopped early.
+    """
+    for future, key in futures.items():
+        if future.done() and not future.cancelled() and future.exception() is None:
+            yield key, future.result()
+
+
 class ResourceList:
     def __init__(self, repository, uri_list=None, file=None, completed_file=None):
         self.repository = repository
@@ -39,7 +79,7 @@ class ResourceList:
             # read the log of completed items
             fieldnames = ['uri', 'title', 'timestamp']
             try:
-                self.completed = ItemLog(completed_file, fieldnames, 'uri')
+                self.completed = open_item_log(completed_file, fieldnames, 'uri')
                 logger.info(f'Found {len(self.completed)} completed item(s)')
             except Exception as e:
                 logger.error(f"Non-standard map file specified: {e}")
@@ -53,7 +93,7 @@ class ResourceList:
             if self.file == '-':
                 # special filename "-" means STDIN
                 for line in sys.stdin:
-                    yield line
+                    yield line.rstrip()
             else:
                 with open(self.file) as fh:
                     for line in fh:
@@ -62,63 +102,91 @@ class ResourceList:
             for uri in self.uri_list:
                 yield uri
 
-    def get_resources(self, traverse=None):
-        for uri in self.get_uris():
-            for resource, graph in self.repository.recursive_get(uri, traverse=traverse):
-                yield resource, graph
+    def get_resources(self, traverse=None, max_depth=None, on_error=None):
+        # the process methods only read the graphs, so use the faster N-Triples decoding
+        return self.repository.walk(
+            self.get_uris(), traverse=traverse, max_depth=max_depth, on_error=on_error, lightweight=True
+        )
 
-    def process(self, method, use_transaction=True, traverse=None):
+    def process(self, method, use_transaction=True, traverse=None, max_depth=None):
         self.use_transaction = use_transaction
         if traverse is not None:
             predicate_list = ', '.join(p.n3() for p in traverse)
             logger.info(f"{method.__name__} will traverse the following predicates: {predicate_list}")
+            if max_depth is not None:
+                logger.info(f"{method.__name__} will stop traversing at depth {max_depth}")
 
         if use_transaction:
-            # set up a temporary ItemLog that will be copied to the real item log upon completion of the transaction
-            self.completed_buffer = ItemLog(
-                NamedTemporaryFile().name,
-                ['uri', 'title', 'timestamp'],
-                'uri',
-                header=False
-            )
+            # hold the completed rows until the transaction is committed, then add them to the real item log
+            self.completed_buffer = []
             with Transaction(self.repository, keep_alive=90) as transaction:
-                for resource, graph in self.get_resources(traverse=traverse):
-                    try:
-                        method(resource, graph)
-                    except RESTAPIException as e:
-                        logger.error(f'{method.__name__} failed for {resource}: {e}: {e.response.text}')
-                        # if anything fails while processing of the list of uris, attempt to
-                        # rollback the transaction. Failures here will be caught by the main
-                        # loop's exception handler and should trigger a system exit
+                try:
+                    # a resource that can't be read stops the whole traversal, so
+                    # that the transaction is never committed with part of it missing
+                    for resource, graph in self.get_resources(traverse=traverse, max_depth=max_depth,
+                                                              on_error=raise_fetch_error):
                         try:
-                            transaction.rollback()
-                            logger.warning('Transaction rolled back.')
-                            return False
-                        except RESTAPIException:
-                            logger.error('Unable to roll back transaction, aborting')
-                            raise FailureException()
+                            method(resource, graph)
+                        except RESTAPIException as e:
+                            logger.error(f'{method.__name__} failed for {resource}: {e}: {e.response.text}')
+                            raise
+                except (RESTAPIException, requests.RequestException, DataReadException):
+                    # if anything fails while processing of the list of uris, attempt to
+                    # rollback the transaction. Failures here will be caught by the main
+                    # loop's exception handler and should trigger a system exit
+                    try:
+                        transaction.rollback()
+                        logger.warning('Transaction rolled back.')
+                        return False
+                    except RESTAPIException:
+                        logger.error('Unable to roll back transaction, aborting')
+                        raise FailureException()
                 transaction.commit()
-                shutil.copyfile(self.completed_buffer.filename, self.completed.filename)
+                if self.completed is not None:
+                    self.completed.writerows(self.completed_buffer)
+                    self.completed.flush()
                 return True
         else:
-            for resource, graph in self.get_resources(traverse=traverse):
+            for resource, graph in self.get_resources(traverse=traverse, max_depth=max_depth):
                 try:
                     method(resource, graph)
                 except RESTAPIException as e:
                     logger.error(f'{method.__name__} failed for {resource}: {e}: {e.response.text}')
                     logger.warning(f'Continuing {method.__name__} with next item')
+            if self.completed is not None:
+                self.completed.flush()
             return True
 
     def log_completed(self, uri, title, timestamp):
         if self.completed is not None:
             row = {'uri': uri, 'title': title, 'timestamp': timestamp}
             if self.use_transaction:
-                self.completed_buffer.writerow(row)
+                self.completed_buffer.append(row)
             else:
                 self.completed.writerow(row)
 
 
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+
+def open_item_log(filename, fieldnames, keyfield, header=True, batch_size=None):
+    """
+    Open an item log with the backend that matches its file name: an SQLite
+    database for names ending in one of SQLITE_EXTENSIONS, or a CSV file for
+    anything else.
+    """
+    if os.path.splitext(filename)[1].lower() in SQLITE_EXTENSIONS:
+        return SQLiteItemLog(filename, fieldnames, keyfield, batch_size=batch_size or 100)
+    else:
+        return ItemLog(filename, fieldnames, keyfield, header=header)
+
+
 class ItemLog:
+    """
+    Log of items in a CSV file. The keys of all the rows are held in memory,
+    so this is best suited to logs of up to a few hundred thousand items; use
+    SQLiteItemLog for larger ones.
+    """
     def __init__(self, filename, fieldnames, keyfield, header=True):
         self.filename = filename
         self.fieldnames = fieldnames
@@ -126,8 +194,11 @@ class ItemLog:
         self.item_keys = set()
         self.fh = None
         self.writer = None
+        self.lock = threading.Lock()
+        self.header = True
 
         if not isfile(self.filename):
+            self.header = header
             with open(self.filename, 'w', 1) as fh:
                 writer = csv.DictWriter(fh, fieldnames=self.fieldnames)
                 if header:
@@ -152,8 +223,34 @@ class ItemLog:
         return self.writer
 
     def writerow(self, row):
-        self.get_writer().writerow(row)
-        self.item_keys.add(row[self.keyfield])
+        self.writerows([row])
+
+    def writerows(self, rows):
+        with self.lock:
+            writer = self.get_writer()
+            for row in rows:
+                writer.writerow(row)
+                self.item_keys.add(row[self.keyfield])
+
+    def flush(self):
+        with self.lock:
+            if self.fh is not None:
+                self.fh.flush()
+
+    def close(self):
+        with self.lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+                self.writer = None
+
+    def __iter__(self):
+        self.flush()
+        with open(self.filename, 'r') as fh:
+            if self.header:
+                yield from csv.DictReader(fh)
+            else:
+                yield from csv.DictReader(fh, fieldnames=self.fieldnames)
 
     def __contains__(self, other):
         return other in self.item_keys
@@ -166,21 +263,314 @@ class ItemLog:
             self.fh.close()
 
 
+class SQLiteItemLog:
+    """
+    Log of items in an SQLite database, with the same interface as ItemLog.
+    Membership is checked against an index on the key field instead of an
+    in-memory set, so opening a log of millions of items is immediate.
+
+    Rows are written in batches of batch_size, and any rows still pending are
+    written when the log is flushed or closed, or the program exits. Several
+    threads or processes can write to the same log at once.
+    """
+    def __init__(self, filename, fieldnames, keyfield, batch_size=100):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.keyfield = keyfield
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_keys = set()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        columns = ', '.join(f'"{name}" TEXT' for name in self.fieldnames)
+        with self.connection() as connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS items ({columns})')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS items_key ON items ("{self.keyfield}")')
+            existing = [info[1] for info in connection.execute('PRAGMA table_info(items)')]
+
+        # check the validity of the log
+        if not existing == fieldnames:
+            raise Exception('Fieldnames in {0} do not match expected fieldnames'.format(filename))
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def schema(filename):
+        """The (fieldnames, keyfield) of an existing SQLite item log"""
+        if not isfile(filename):
+            raise Exception('{0} does not exist'.format(filename))
+        connection = sqlite3.connect(filename)
+        try:
+            fieldnames = [info[1] for info in connection.execute('PRAGMA table_info(items)')]
+            keys = [info[2] for info in connection.execute("PRAGMA index_info('items_key')")]
+        finally:
+            connection.close()
+        if not fieldnames or not keys:
+            raise Exception('{0} is not an item log'.format(filename))
+        return fieldnames, keys[0]
+
+    def connection(self):
+        # same scheme as DigestCache: one connection per thread and process
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = sqlite3.connect(self.filename, timeout=60)
+            self.local.connection.execute('PRAGMA journal_mode=WAL')
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def writerow(self, row):
+        self.writerows([row])
+
+    def writerows(self, rows):
+        with self.lock:
+            for row in rows:
+                self.pending.append(tuple(
+                    None if row.get(name) is None else str(row[name]) for name in self.fieldnames
+                ))
+                self.pending_keys.add(str(row[self.keyfield]))
+            if len(self.pending) >= self.batch_size:
+                self._write_pending()
+
+    def flush(self):
+        with self.lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        if not self.pending:
+            return
+        columns = ', '.join(f'"{name}"' for name in self.fieldnames)
+        placeholders = ', '.join('?' for _ in self.fieldnames)
+        with self.connection() as connection:
+            connection.executemany(f'INSERT INTO items ({columns}) VALUES ({placeholders})', self.pending)
+        self.pending = []
+        self.pending_keys = set()
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+
+    def import_csv(self, filename):
+        """Add all the rows of an ItemLog CSV file with the same fieldnames to this log"""
+        with open(filename, 'r') as fh:
+            reader = csv.DictReader(fh)
+            if not reader.fieldnames == self.fieldnames:
+                raise Exception('Fieldnames in {0} do not match expected fieldnames'.format(filename))
+            self.writerows(reader)
+        self.flush()
+
+    def export_csv(self, filename):
+        """Write all the rows of this log to a CSV file that can be read as an ItemLog"""
+        with open(filename, 'w') as fh:
+            writer = csv.DictWriter(fh, fieldnames=self.fieldnames)
+            writer.writeheader()
+            writer.writerows(self)
+
+    def __iter__(self):
+        self.flush()
+        columns = ', '.join(f'"{name}"' for name in self.fieldnames)
+        for values in self.connection().execute(f'SELECT {columns} FROM items ORDER BY rowid'):
+            yield dict(zip(self.fieldnames, values))
+
+    def __contains__(self, other):
+        key = str(other)
+        with self.lock:
+            if key in self.pending_keys:
+                return True
+        row = self.connection().execute(
+            f'SELECT 1 FROM items WHERE "{self.keyfield}" = ? LIMIT 1', (key,)
+        ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        self.flush()
+        return self.connection().execute(f'SELECT COUNT(DISTINCT "{self.keyfield}") FROM items').fetchone()[0]
+
+
+def compute_digests(source, algorithms=('sha1',), block_size=STREAM_BLOCK_SIZE, use_mmap=False):
+    """
+    Computes one or more digests (any algorithm known to hashlib) of a file
+    path or binary stream in a single pass, and returns a dict mapping each
+    algorithm name to its hex digest.
+
+    Data is read in fixed-size blocks into a reused buffer (or, for a path
+    with use_mmap, hashed straight from a memory map). hashlib releases the
+    GIL while hashing large blocks, so several files can be hashed at once
+    from a thread pool.
+    """
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, 'rb', buffering=0) as stream:
+            if use_mmap and os.fstat(stream.fileno()).st_size > 0:
+                with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        for start in range(0, len(view), block_size):
+                            for h in hashes:
+                                h.update(view[start:start + block_size])
+                    finally:
+                        view.release()
+            else:
+                _update_hashes(hashes, stream, block_size)
+    else:
+        _update_hashes(hashes, source, block_size)
+
+    return {algorithm: h.hexdigest() for algorithm, h in zip(algorithms, hashes)}
+
+
+def _update_hashes(hashes, stream, block_size):
+    if hasattr(stream, 'readinto'):
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        while True:
+            length = stream.readinto(buffer)
+            if not length:
+                break
+            for h in hashes:
+                h.update(view[:length])
+    else:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            for h in hashes:
+                h.update(block)
+
+
 class BinarySource(object):
     def __init__(self):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
+    # a digest of the data that is already known without reading it, or None
+    def precomputed_digest(self):
+        return None
+
+    # called with the digest of the data returned by the most recent call to data()
+    def record_digest(self, digest):
+        pass
+
+
+class DigestCache:
+    """
+    Persistent cache of file digests in an SQLite database. Entries are keyed
+    by the file's real path, size, modification time, and inode, so a digest
+    is only reused if the file has not changed since it was computed. Safe to
+    use from multiple threads and processes.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.local = threading.local()
+        with self.connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS digests ('
+                'path TEXT, algorithm TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER, digest TEXT, '
+                'PRIMARY KEY (path, algorithm))'
+            )
+
+    def connection(self):
+        # SQLite connections can't be shared between threads, or carried
+        # across a fork, so each thread in each process gets its own
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = sqlite3.connect(self.filename, timeout=60)
+            self.local.connection.execute('PRAGMA journal_mode=WAL')
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    @staticmethod
+    def file_key(path):
+        """The (realpath, size, mtime_ns, inode) tuple that identifies the current contents of a file"""
+        stat = os.stat(path)
+        return os.path.realpath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, path, algorithm='sha1'):
+        realpath, size, mtime_ns, inode = self.file_key(path)
+        row = self.connection().execute(
+            'SELECT digest FROM digests WHERE path = ? AND algorithm = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+            (realpath, algorithm, size, mtime_ns, inode)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, path, digest, algorithm='sha1', key=None):
+        """
+        Record the digest of a file. To avoid caching a digest of data that
+        changed while it was being read, pass the file_key() from before the
+        read as key.
+        """
+        if key is None:
+            key = self.file_key(path)
+        realpath, size, mtime_ns, inode = key
+        with self.connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO digests (path, algorithm, size, mtime_ns, inode, digest) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (realpath, algorithm, size, mtime_ns, inode, digest)
+            )
+
+
+class ExportCache:
+    """
+    Persistent record, in an SQLite database, of the export files already
+    uploaded to the repository, keyed by a digest of everything that
+    determines an export's contents (see plastron.commands.export.export_key).
+    Uses the same connection scheme as DigestCache.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.local = threading.local()
+        with self.connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS exports (key TEXT PRIMARY KEY, uri TEXT)'
+            )
+
+    def connection(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = sqlite3.connect(self.filename, timeout=60)
+            self.local.connection.execute('PRAGMA journal_mode=WAL')
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def get(self, key):
+        row = self.connection().execute('SELECT uri FROM exports WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key, uri):
+        with self.connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO exports (key, uri) VALUES (?, ?)', (key, str(uri)))
+
+    def remove(self, key):
+        with self.connection() as connection:
+            connection.execute('DELETE FROM exports WHERE key = ?', (key,))
+
 
 class LocalFile(BinarySource):
-    def __init__(self, localpath, mimetype=None, filename=None):
+    # DigestCache shared by all local files, if configured
+    digest_cache = None
+
+    def __init__(self, localpath, mimetype=None, filename=None, digest=None):
         super().__init__()
         if mimetype is None:
             mimetype = mimetypes.guess_type(localpath)[0]
         self._mimetype = mimetype
+        self._digest = digest
+        self._data_key = None
         self.localpath = localpath
         self.filename = filename if filename is not None else basename(localpath)
 
+    def precomputed_digest(self):
+        if self._digest is None and self.digest_cache is not None:
+            cached = self.digest_cache.get(self.localpath)
+            if cached is not None:
+                self._digest = 'sha1=' + cached
+        return self._digest
+
+    def record_digest(self, digest):
+        self._digest = digest
+        if self.digest_cache is not None and self._data_key is not None:
+            self.digest_cache.put(self.localpath, digest.split('=', 1)[1], key=self._data_key)
+
     def data(self):
+        if self.digest_cache is not None:
+            self._data_key = DigestCache.file_key(self.localpath)
         return open(self.localpath, 'rb')
 
     def mimetype(self):
@@ -188,18 +578,99 @@ class LocalFile(BinarySource):
 
     # generate SHA1 checksum on a file
     def digest(self):
-        sha1 = hashlib.sha1()
-        with self.data() as stream:
-            for block in stream:
-                sha1.update(block)
-        return 'sha1=' + sha1.hexdigest()
+        if self.precomputed_digest() is not None:
+            return self._digest
+        if self.digest_cache is not None:
+            self._data_key = DigestCache.file_key(self.localpath)
+        digests = compute_digests(self.localpath)
+        self.record_digest('sha1=' + digests['sha1'])
+        return self._digest
+
+
+class ObservedStream:
+    """
+    Wraps a binary stream so that every block read from it is also passed to
+    the update() method of each of the observers (e.g., hashlib objects), so
+    the data can be uploaded, hashed, and inspected in a single pass.
+    """
+    def __init__(self, stream, observers):
+        self.stream = stream
+        self.observers = observers
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        for observer in self.observers:
+            observer.update(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(STREAM_BLOCK_SIZE)
+            if not data:
+                break
+            yield data
+
+    def __getattr__(self, name):
+        # pass through fileno(), tell(), seek(), etc. so that requests can
+        # work out the length of the body from the underlying stream
+        return getattr(self.stream, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stream.close()
+
+
+def digest_matches(digest, header):
+    """
+    True if the "sha1=<hex>" digest matches the SHA-1 value in an HTTP Digest
+    header (RFC 3230), which may be either hex or base64 encoded.
+    """
+    expected = digest.split('=', 1)[1].lower()
+    for value in header.split(','):
+        algorithm, _, encoded = value.strip().partition('=')
+        if algorithm.lower() not in ('sha', 'sha1', 'sha-1'):
+            continue
+        if encoded.lower() == expected:
+            return True
+        try:
+            if base64.b64decode(encoded).hex() == expected:
+                return True
+        except ValueError:
+            pass
+    return False
+
+
+class ExternalContent:
+    """
+    Maps local files under base_path to URLs under base_url (e.g., file:// or
+    http:// URLs) where the repository can reach the same files, so binaries
+    can be created as references to that content instead of being uploaded.
+    If verify_digest is true, the digest of the local file is compared with
+    the one the repository reports for the referenced content.
+    """
+    def __init__(self, base_path, base_url, verify_digest=False):
+        self.base_path = os.path.abspath(base_path)
+        self.base_url = base_url.rstrip('/')
+        self.verify_digest = verify_digest
+
+    def url_for(self, source):
+        """The external URL for a binary source, or None if it has to be uploaded"""
+        if not isinstance(source, LocalFile):
+            return None
+        relpath = os.path.relpath(os.path.abspath(source.localpath), self.base_path)
+        if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            return None
+        return self.base_url + '/' + quote(relpath.replace(os.sep, '/'))
 
 
 class RepositoryFile(BinarySource):
-    def __init__(self, repo, file_uri):
+    def __init__(self, repo, file_uri, head_response=None):
         super().__init__()
         file_uri = URIRef(file_uri)
-        head_res = repo.head(file_uri)
+        # callers that have already made a HEAD request for the file can pass its response
+        head_res = head_response if head_response is not None else repo.head(file_uri)
         if 'describedby' in head_res.links:
             rdf_uri = head_res.links['describedby']['url']
             file_graph = repo.get_graph(rdf_uri)
@@ -264,5 +735,10 @@ class RemoteFile(BinarySource):
         return self._mimetype
 
     def digest(self):
-        sha1sum = self.ssh_exec(f'sha1sum "{self.remotepath}"').split()[0]
-        return 'sha1=' + sha1sum
+        output = self.ssh_exec(f'sha1sum "{self.remotepath}"')
+        if output:
+            return 'sha1=' + output.split()[0]
+        # no sha1sum on the remote host, so stream the data and hash it here
+        self.logger.debug(f'Unable to run sha1sum on {self.host}; computing digest locally')
+        with self.data() as stream:
+            return 'sha1=' + compute_digests(stream)['sha1']